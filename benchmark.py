@@ -0,0 +1,450 @@
+"""
+Benchmark suite for the message pipeline.
+
+Generates synthetic Pune_Market_Rates_*.xlsx workbooks, measures startup and
+the hot paths (routing, get_rate, history answers, respond_to_query), then
+replays a mix of rate, weather and news messages through handle_message, with
+Telegram, OpenWeatherMap and Agrowon replaced by the local servers in
+fakeServers.py. Results are printed and saved as JSON:
+
+    python benchmark.py --items 286 --days 90 --users 50 --messages 2000
+    python benchmark.py --data-dir priceData --no-generate --upstream-latency 0.2
+    python benchmark.py --compare benchmark-old.json benchmark-new.json
+
+The fake servers run in the same process and event loop as the bot, so their
+(small) overhead is included in the throughput and RSS figures.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import mapping, queryRouter, services, telBot
+from fakeServers import FakeAgrowon, FakeOpenWeather, FakeTelegram
+from priceStore import FILE_PREFIX, FILE_SUFFIX, SNAPSHOT_DIR_NAME
+
+logger = logging.getLogger("benchmark")
+
+# --- Default Workload ---
+DEFAULT_MIX = "rate=0.75,weather=0.15,news=0.1"
+REPLY_TIMEOUT = 60.0  # seconds a simulated user waits for one answer
+# Metrics shown by --compare: (label, path in the results JSON, True if higher is better)
+COMPARED_METRICS = [
+    ("startup (first)", "startup.first_start_s", False),
+    ("startup (restart)", "startup.restart_s", False),
+    ("route p50", "micro.route.p50_ms", False),
+    ("get_rate cached p50", "micro.get_rate_cached.p50_ms", False),
+    ("get_rate uncached p50", "micro.get_rate_uncached.p50_ms", False),
+    ("history uncached p50", "micro.history_uncached.p50_ms", False),
+    ("respond_to_query p99", "micro.respond_to_query.p99_ms", False),
+    ("replay throughput", "replay.throughput_msg_s", True),
+    ("replay p50", "replay.latency.p50_ms", False),
+    ("replay p99", "replay.latency.p99_ms", False),
+    ("peak RSS", "peak_rss_mb", False),
+]
+
+# Message templates; {item}/{item2} are English item keys, {city} a CITY name, {day} a date in the data
+RATE_TEMPLATES = [
+    "{item} rate", "rate of {item}", "what is the price of {item}", "{item} bhav",
+    "{item} and {item2} rate", "{item} rate on {day}", "{item} average last 30 days",
+    "{item} trend", "{item} min max this month", "{item} week over week",
+]
+WEATHER_TEMPLATES = ["weather", "weather in {city}", "{city} weather", "हवामान"]
+NEWS_TEMPLATES = ["news", "latest news", "बातमी"]
+QUANTITIES = ["क्विंटल"] * 8 + ["शेकडा", "गड़ी"]
+
+
+# --- Synthetic Data ---
+
+def synthetic_item_names(count):
+    """`count` item names: the Marathi names from ITEM_MAPPING_CONFIG first, then numbered variants."""
+    names = list(dict.fromkeys(mapping.ITEM_MAPPING_CONFIG.values()))
+    base = len(names)
+    for i in range(count - base):
+        names.append(f"{names[i % base]} {i // base + 2}")
+    return names[:count]
+
+
+def generate_workbooks(data_dir, items=286, days=90, files=3, end=None, seed=0, missing=0.1):
+    """
+    Writes `files` workbooks covering `days` consecutive days for `items` items,
+    in the column layout of the APMC exports. Rates follow a random walk per item
+    and a `missing` share of the rows has no rate, like untraded items do.
+    Returns the number of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+    names = synthetic_item_names(items)
+    all_days = [end - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    base = rng.uniform(500, 15000, size=len(names))
+    quantities = [QUANTITIES[i % len(QUANTITIES)] for i in range(len(names))]
+    os.makedirs(data_dir, exist_ok=True)
+
+    rows_written = 0
+    for index, chunk in enumerate(np.array_split(np.arange(days), files)):
+        rows = []
+        for day_index in chunk:
+            day = all_days[day_index].strftime("%d-%m-%Y")
+            base = np.maximum(base * rng.normal(1.0, 0.03, size=len(names)), 50)
+            spread = rng.uniform(1.1, 1.6, size=len(names))
+            traded = rng.random(len(names)) >= missing
+            for i, name in enumerate(names):
+                low, high = (f"Rs. {base[i]:.0f}/-", f"Rs. {base[i] * spread[i]:.0f}/-") if traded[i] else (None, None)
+                rows.append((day, "Pune", "फळभाजी (तरकारी)", str(1000 + i), name, quantities[i],
+                             str(int(rng.integers(1, 900))) if traded[i] else None, low, high))
+        frame = pd.DataFrame(rows, columns=["Date", "Market", "शेतिमालाचा प्रकार", "कोड नं.", "शेतिमाल", "परिमाण", "आवक", "किमान", "कमाल"])
+        frame.to_excel(os.path.join(data_dir, f"{FILE_PREFIX}Synthetic_{index:03d}{FILE_SUFFIX}"), index=False)
+        rows_written += len(rows)
+    return rows_written
+
+
+def build_messages(bot_instance, count, mix, seed=0):
+    """Returns [(kind, text)] drawn from the templates according to `mix` ({kind: weight})."""
+    rng = random.Random(seed)
+    # English keys whose item is actually in the loaded data, so rate questions find an answer
+    keys = sorted(key for key in mapping.ITEM_MAPPING_CONFIG if bot_instance.resolve_item(key) in bot_instance.data)
+    if not keys:
+        raise SystemExit("None of the ITEM_MAPPING_CONFIG items are in the price data.")
+    last_dates = [series.last_date for series in bot_instance.data.values()]
+    newest = max(last_dates)
+    cities = [city.split(",")[0] for city in telBot.CITY]
+    templates = {"rate": RATE_TEMPLATES, "weather": WEATHER_TEMPLATES, "news": NEWS_TEMPLATES}
+    kinds, weights = zip(*mix.items())
+
+    messages = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        text = rng.choice(templates[kind]).format(
+            item=rng.choice(keys),
+            item2=rng.choice(keys),
+            city=rng.choice(cities),
+            day=(newest - timedelta(days=rng.randrange(30))).strftime("%d-%m-%Y"),
+        )
+        messages.append((kind, text))
+    return messages
+
+
+# --- Measurement Helpers ---
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where `resource` is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_summary(samples):
+    """Count, mean and percentiles (milliseconds) of a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p90_ms": round(float(p90), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def call_summary(samples):
+    """latency_summary of back-to-back calls, plus the calls per second they add up to."""
+    summary = latency_summary(samples)
+    total = sum(samples)
+    summary["ops_s"] = round(len(samples) / total, 1) if total else None
+    return summary
+
+
+def time_calls(fn, args_list, before_each=None):
+    """Calls fn(*args) for every entry of args_list and returns the duration of each call."""
+    durations = []
+    for args in args_list:
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def time_async_calls(fn, args_list):
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        await fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# --- Benchmark Stages ---
+
+def measure_startup(data_dir):
+    """Times two AgriBot constructions: the first may parse workbooks, the second reads snapshots."""
+    snapshots_present = os.path.isdir(os.path.join(data_dir, SNAPSHOT_DIR_NAME))
+    start = time.perf_counter()
+    first = telBot.AgriBot(data_dir)
+    first_start = time.perf_counter() - start
+    start = time.perf_counter()
+    bot_instance = telBot.AgriBot(data_dir)
+    restart = time.perf_counter() - start
+    startup = {
+        "snapshots_present": snapshots_present,
+        "first_start_s": round(first_start, 4),
+        "restart_s": round(restart, 4),
+        "items": len(bot_instance.data),
+        "rows": int(sum(len(series.dates) for series in bot_instance.data.values())),
+        "rss_after_load_mb": peak_rss_mb(),
+    }
+    return first, bot_instance, startup
+
+
+async def measure_hot_paths(bot_instance, messages, iterations):
+    """Per-call timings of the synchronous pieces of respond_to_query, without any network."""
+    rng = random.Random(1)
+    rate_texts = [text for kind, text in messages if kind == "rate"] or ["onion rate"]
+    items = sorted(bot_instance.data)
+    sample_texts = [(rng.choice(rate_texts),) for _ in range(iterations)]
+    sample_items = [(rng.choice(items),) for _ in range(iterations)]
+    hot_items = [(item,) for item in items[:20]] * (iterations // 20 + 1)
+
+    bot_instance.rate_cache.clear()
+    micro = {
+        "route": call_summary(time_calls(bot_instance.router.parse, sample_texts)),
+        "get_rate_uncached": call_summary(time_calls(bot_instance.get_rate, sample_items, bot_instance.rate_cache.clear)),
+    }
+    bot_instance.rate_cache.clear()
+    for args in hot_items[:20]:
+        bot_instance.get_rate(*args)
+    micro["get_rate_cached"] = call_summary(time_calls(bot_instance.get_rate, hot_items[:iterations]))
+    micro["history_uncached"] = call_summary(time_calls(
+        lambda item: bot_instance.get_price_history(item, queryRouter.TREND),
+        sample_items,
+        bot_instance.rate_cache.clear,
+    ))
+    bot_instance.rate_cache.clear()
+    micro["respond_to_query"] = call_summary(await time_async_calls(bot_instance.respond_to_query, sample_texts))
+    micro["refresh_unchanged"] = call_summary(time_calls(bot_instance.refresh_data, [()] * 20))
+    micro["rate_cache"] = bot_instance.rate_cache.stats()
+    return micro
+
+
+async def replay(bot_instance, messages, users, telegram, concurrent_updates):
+    """
+    Sends `messages` through a polling Application backed by `telegram`. Each of
+    `users` simulated users sends its share one at a time and waits for the
+    answer (closed loop), so latency is the time from delivery to the reply.
+    """
+    telBot.CONCURRENT_UPDATES = concurrent_updates
+    app = telBot.build_bot_application(bot_instance)
+    await app.initialize()
+    await telBot.start_background_tasks(app)
+    await app.updater.start_polling(poll_interval=0.0, timeout=10)
+    await app.start()
+    # Warm the news cache the way the background refresher does at startup
+    await bot_instance.news.refresh()
+
+    per_user = {user_id: messages[user_id - 1::users] for user_id in range(1, users + 1)}
+    latencies = {kind: [] for kind in ("rate", "weather", "news")}
+    failures = {"timeouts": 0, "errors": 0}
+
+    async def simulate(user_id, queue):
+        for count, (kind, text) in enumerate(queue, start=1):
+            start = time.perf_counter()
+            await telegram.inject(telegram.text_update(user_id, text))
+            try:
+                replies = await telegram.wait_for_replies(count, REPLY_TIMEOUT, chat_id=user_id)
+            except asyncio.TimeoutError:
+                failures["timeouts"] += 1
+                return
+            latencies[kind].append(time.perf_counter() - start)
+            if replies[count - 1].get("text", "").startswith(("Oops!", "🚧", "⏳")):
+                failures["errors"] += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(simulate(user_id, queue) for user_id, queue in per_user.items()))
+    finally:
+        duration = time.perf_counter() - start
+        await app.updater.stop()
+        await app.stop()
+        await telBot.stop_background_tasks(app)
+        await app.shutdown()
+
+    completed = sum(len(samples) for samples in latencies.values())
+    return {
+        "users": users,
+        "messages": len(messages),
+        "completed": completed,
+        **failures,
+        "duration_s": round(duration, 4),
+        "throughput_msg_s": round(completed / duration, 2) if duration else None,
+        "latency": latency_summary([sample for samples in latencies.values() for sample in samples]),
+        "latency_by_kind": {kind: latency_summary(samples) for kind, samples in latencies.items()},
+        "telegram_requests": telegram.requests,
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("rate", "weather", "news"):
+            raise argparse.ArgumentTypeError(f"unknown message kind '{kind}'")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+async def run(args):
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key != "compare"},
+    }
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="agribot-bench-")
+    try:
+        if not args.no_generate:
+            start = time.perf_counter()
+            rows = generate_workbooks(data_dir, args.items, args.days, args.files, seed=args.seed)
+            results["generate"] = {"rows": rows, "seconds": round(time.perf_counter() - start, 3)}
+            logger.warning(f"Generated {rows} rows in {data_dir}.")
+
+        telegram = await FakeTelegram(latency=args.telegram_latency).start()
+        weather = await FakeOpenWeather(latency=args.upstream_latency, seed=args.seed).start()
+        agrowon = await FakeAgrowon(latency=args.upstream_latency, page_size=args.news_page_size).start()
+        telBot.TELEGRAM_API_BASE_URL = telegram.base_url
+        services.OPENWEATHER_URL = weather.weather_url
+        services.AGROWON_BASE_URL = agrowon.url
+        mapping.NEWS_SOURCES = agrowon.sources()
+        # The replay measures the pipeline, not the per-user rate limiter
+        telBot.RATE_LIMIT_BURST = args.messages + 1
+        telBot.RATE_LIMIT_PER_MINUTE = 60 * args.messages
+
+        try:
+            first, bot_instance, results["startup"] = measure_startup(data_dir)
+            await first.aclose()
+            bot_instance.semantic_lookup = args.semantic
+            if args.weather_ttl is not None:
+                bot_instance.weather.ttl = args.weather_ttl
+            logger.warning(f"Startup: {results['startup']}")
+
+            messages = build_messages(bot_instance, args.messages, parse_mix(args.mix), seed=args.seed)
+            results["micro"] = await measure_hot_paths(bot_instance, messages, args.iterations)
+            results["replay"] = await replay(bot_instance, messages, args.users, telegram, args.concurrent_updates)
+            results["upstream_requests"] = {"openweather": weather.requests, "agrowon": agrowon.requests}
+        finally:
+            for server in (telegram, weather, agrowon):
+                await server.stop()
+    finally:
+        if not args.data_dir and not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def _lookup(results, path):
+    value = results
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(old_path, new_path):
+    """Prints the COMPARED_METRICS of two result files side by side."""
+    with open(old_path, encoding="utf-8") as fh:
+        old = json.load(fh)
+    with open(new_path, encoding="utf-8") as fh:
+        new = json.load(fh)
+    print(f"{'metric':<24} {'old':>12} {'new':>12} {'change':>9}")
+    for label, path, higher_is_better in COMPARED_METRICS:
+        before, after = _lookup(old, path), _lookup(new, path)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        better = after > before if higher_is_better else after < before
+        marker = " " if before == after else "✓" if better else "✗"
+        print(f"{label:<24} {before:>12} {after:>12} {change:>9} {marker}")
+
+
+def print_summary(results):
+    startup, replay_results = results["startup"], results["replay"]
+    print(f"Data: {startup['items']} items, {startup['rows']} rows")
+    print(f"Startup: first {startup['first_start_s']}s, restart {startup['restart_s']}s")
+    print(f"{'hot path':<20} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>10}")
+    for name, summary in results["micro"].items():
+        if "p50_ms" in summary:
+            print(f"{name:<20} {summary['p50_ms']:>10} {summary['p99_ms']:>10} {summary['ops_s']:>10}")
+    latency = replay_results["latency"]
+    print(f"Replay: {replay_results['completed']}/{replay_results['messages']} messages from {replay_results['users']} users "
+          f"in {replay_results['duration_s']}s -> {replay_results['throughput_msg_s']} msg/s, "
+          f"p50 {latency.get('p50_ms')} ms, p99 {latency.get('p99_ms')} ms "
+          f"({replay_results['timeouts']} timeouts, {replay_results['errors']} errors)")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AgriBot message pipeline against local fake services.")
+    parser.add_argument("--data-dir", help="workbook directory (default: a temporary directory)")
+    parser.add_argument("--no-generate", action="store_true", help="use the workbooks already in --data-dir")
+    parser.add_argument("--keep-data", action="store_true", help="keep the generated temporary directory")
+    parser.add_argument("--items", type=int, default=286, help="items per day in the generated data")
+    parser.add_argument("--days", type=int, default=90, help="days of generated data")
+    parser.add_argument("--files", type=int, default=3, help="workbooks the generated days are split into")
+    parser.add_argument("--messages", type=int, default=1000, help="messages replayed through handle_message")
+    parser.add_argument("--users", type=int, default=50, help="simulated users sending concurrently")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"message mix as kind=weight pairs (default: {DEFAULT_MIX})")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per hot-path measurement")
+    parser.add_argument("--concurrent-updates", type=int, default=telBot.CONCURRENT_UPDATES)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds added to OpenWeatherMap and Agrowon responses")
+    parser.add_argument("--news-page-size", type=int, default=200_000, help="bytes per fake Agrowon page")
+    parser.add_argument("--weather-ttl", type=float, help="override WEATHER_CACHE_TTL to force more upstream calls")
+    parser.add_argument("--semantic", action="store_true", help="allow the embedding fallback (loads the model)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file (default: benchmark-<timestamp>.json)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.no_generate and not args.data_dir:
+        parser.error("--no-generate needs --data-dir")
+
+    logging.getLogger().setLevel(args.log_level)
+    results = asyncio.run(run(args))
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, ensure_ascii=False, indent=2, default=str)
+    print_summary(results)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+End-to-end check of the ways the bot can run: long polling, webhook and
+sharded workers (run_sharded). Each mode starts the real entry point in a
+subprocess with Telegram replaced by fakeServers.FakeTelegram; several users
+then send a burst of rate questions, and every user must get all answers back
+in the order they asked.
+
+    python endToEnd.py                      # polling, webhook and sharded
+    python endToEnd.py webhook --users 8 --messages 3
+    python endToEnd.py sharded --workers 3 --verbose
+
+Uses the workbooks in telBot.DATA_DIR. Exits with status 1 if any mode fails.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+from fakeServers import FakeTelegram
+
+logger = logging.getLogger("endToEnd")
+
+MODES = ("polling", "webhook", "sharded")
+# Each message asks for a different item, so a reply shows which message it answers
+ITEMS = ["कांदा", "बटाटा", "टोमॅटो", "अंजीर", "केळी"]
+WEBHOOK_SECRET = "end-to-end-secret"
+START_TIMEOUT = 60.0  # seconds the bot may take to start (sharded workers import everything again)
+REPLY_TIMEOUT = 60.0
+STOP_TIMEOUT = 20.0
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(mode, base_url, webhook_port, workers):
+    """Child process: runs the bot in `mode` against the fake Bot API until SIGINT."""
+    import telBot
+    telBot.TELEGRAM_API_BASE_URL = base_url
+    telBot.METRICS_PORT = None
+    if mode == "webhook":
+        telBot.BOT_MODE = "webhook"
+        telBot.WEBHOOK_LISTEN = "127.0.0.1"
+        telBot.WEBHOOK_PORT = webhook_port
+        telBot.WEBHOOK_URL = f"http://127.0.0.1:{webhook_port}/{telBot.WEBHOOK_PATH}"
+        telBot.WEBHOOK_SECRET = WEBHOOK_SECRET
+    if mode == "sharded":
+        telBot.run_sharded(workers)
+    else:
+        telBot.run_application(telBot.build_bot_application(telBot.AgriBot()))
+
+
+async def _inject(telegram, update, deadline):
+    """inject(), retrying while the bot's webhook server is still starting."""
+    while True:
+        try:
+            return await telegram.inject(update)
+        except httpx.TransportError:
+            if asyncio.get_running_loop().time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def check_mode(mode, users, messages, workers, verbose):
+    """Runs one mode; returns a list of problems (empty if every user got its answers in order)."""
+    telegram = await FakeTelegram().start()
+    log = None if verbose else tempfile.TemporaryFile()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", mode, telegram.base_url,
+               str(_free_port()), "--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log, stderr=log)
+    problems = []
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + START_TIMEOUT
+        if mode == "webhook":
+            # Updates can only be pushed once the bot has registered its webhook
+            while telegram.webhook is None:
+                if process.poll() is not None or loop.time() > deadline:
+                    raise RuntimeError("the bot never called setWebhook")
+                await asyncio.sleep(0.1)
+
+        # Interleave the users so their messages overlap, like real traffic
+        for index in range(messages):
+            for user_id in range(1, users + 1):
+                item = ITEMS[index % len(ITEMS)]
+                await _inject(telegram, telegram.text_update(user_id, f"{item} rate"), deadline)
+        await telegram.wait_for_replies(users * messages, timeout=START_TIMEOUT + REPLY_TIMEOUT)
+
+        for user_id in range(1, users + 1):
+            replies = [params.get("text", "") for params in telegram.replies_to(user_id)]
+            for index, text in enumerate(replies):
+                item = ITEMS[index % len(ITEMS)] if index < messages else None
+                if item is None or f"for {item}" not in text:
+                    problems.append(f"user {user_id}, reply {index + 1}: expected {item}, got {text[:60]!r}")
+                    break
+            if len(replies) != messages:
+                problems.append(f"user {user_id}: {len(replies)} of {messages} replies")
+    except (asyncio.TimeoutError, RuntimeError) as e:
+        problems.append(str(e))
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            problems.append("the bot did not stop on SIGINT")
+        await telegram.stop()
+        if log is not None:
+            if problems:
+                log.seek(0)
+                sys.stderr.write(log.read().decode("utf-8", "replace")[-4000:])
+            log.close()
+    return problems
+
+
+async def run(args):
+    failed = False
+    for mode in args.modes or MODES:
+        problems = await check_mode(mode, args.users, args.messages, args.workers, args.verbose)
+        print(f"{mode:<8} {'ok' if not problems else 'FAILED'}")
+        for problem in problems:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check polling, webhook and sharded mode end to end against a fake Telegram.")
+    parser.add_argument("modes", nargs="*", help=f"modes to check: {', '.join(MODES)} (default: all)")
+    parser.add_argument("--users", type=int, default=6, help="users sending messages at the same time")
+    parser.add_argument("--messages", type=int, default=4, help="messages per user (at most the rate-limit burst)")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes in sharded mode")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    parser.add_argument("--serve", nargs=3, metavar=("MODE", "BASE_URL", "WEBHOOK_PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        mode, base_url, webhook_port = args.serve
+        serve(mode, base_url, int(webhook_port), args.workers)
+        return
+    unknown = [mode for mode in args.modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(unknown)}")
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Local stand-ins for the services the bot talks to, for end-to-end runs without
+the internet. Each server is a minimal asyncio HTTP/1.1 server (stdlib only).
+
+    fake = FakeTelegram()
+    await fake.start()
+    # point telBot at fake.base_url (TELEGRAM_API_BASE_URL), then:
+    await fake.inject(fake.text_update(user_id=1, text="onion rate"))
+    replies = await fake.wait_for_replies(1)
+
+FakeOpenWeather and FakeAgrowon stand in for the weather API and the news
+pages; see benchmark.py for how the bot is pointed at them. Every server takes
+a `latency` (seconds) added before each response.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class FakeHTTPServer:
+    """Tiny keep-alive HTTP server; subclasses implement handle(method, path, query, headers, body)."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency  # seconds added before every response
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def handle(self, method, path, query, headers, body):
+        """Returns (status, content type, body bytes)."""
+        raise NotImplementedError
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                parts = urlsplit(target)
+                try:
+                    status, content_type, payload = await self.handle(method, parts.path, parse_qs(parts.query), headers, body)
+                except Exception as e:
+                    logger.error(f"Fake server error for {method} {target}: {e}", exc_info=True)
+                    status, content_type, payload = 500, "text/plain", str(e).encode()
+
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Event loop shutting down while a long poll is pending
+            pass
+        finally:
+            writer.close()
+
+
+def _json(payload, status=200):
+    return status, "application/json", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+class FakeTelegram(FakeHTTPServer):
+    """
+    Bot API stand-in. Updates passed to inject() are served through getUpdates,
+    or POSTed to the webhook once the bot has called setWebhook. Messages the
+    bot sends are collected in self.sent.
+    """
+
+    BOT_USER = {"id": 1000, "is_bot": True, "first_name": "AgriBot", "username": "agri_test_bot"}
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__(host, port, latency)
+        self.sent = []  # sendMessage parameters, in arrival order
+        self.sent_times = []  # time.perf_counter() at which each of them arrived
+        self.webhook = None  # (url, secret token) after setWebhook
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._new_reply = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._client = None
+
+    @property
+    def base_url(self):
+        """Value for ApplicationBuilder.base_url / telBot.TELEGRAM_API_BASE_URL."""
+        return f"{self.url}/bot"
+
+    async def stop(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        await super().stop()
+
+    def text_update(self, user_id, text, chat_id=None):
+        """Builds a private-chat text message update."""
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id or user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            # Telegram marks commands with an entity; CommandHandler and filters.COMMAND rely on it
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    async def inject(self, update):
+        """Delivers an update to the bot as Telegram would."""
+        if self.webhook:
+            url, secret = self.webhook
+            headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=30)
+            response = await self._client.post(url, json=update, headers=headers)
+            response.raise_for_status()
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+
+    def replies_to(self, chat_id):
+        return [params for params in self.sent if params.get("chat_id") == chat_id]
+
+    async def wait_for_replies(self, count, timeout=30.0, chat_id=None):
+        """Waits until at least `count` messages were sent (to `chat_id`, if given); returns them."""
+        def received():
+            return self.sent if chat_id is None else self.replies_to(chat_id)
+
+        async with self._new_reply:
+            try:
+                await asyncio.wait_for(self._new_reply.wait_for(lambda: len(received()) >= count), timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f"got {len(received())} of {count} replies") from None
+        return received()
+
+    @staticmethod
+    def _params(headers, body, query):
+        params = {key: values[-1] for key, values in query.items()}
+        if headers.get("content-type", "").startswith("application/json") and body:
+            params.update(json.loads(body))
+        elif body:
+            for key, values in parse_qs(body.decode("utf-8")).items():
+                try:
+                    params[key] = json.loads(values[-1])
+                except ValueError:
+                    params[key] = values[-1]
+        return params
+
+    async def handle(self, method, path, query, headers, body):
+        api_method = path.rsplit("/", 1)[-1]
+        params = self._params(headers, body, query)
+        if api_method == "getMe":
+            return _json({"ok": True, "result": self.BOT_USER})
+        if api_method == "getUpdates":
+            return _json({"ok": True, "result": await self._get_updates(params)})
+        if api_method == "sendMessage":
+            async with self._new_reply:
+                self.sent.append(params)
+                self.sent_times.append(time.perf_counter())
+                self._new_reply.notify_all()
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "private"},
+                "from": self.BOT_USER,
+                "text": params.get("text", ""),
+            }
+            return _json({"ok": True, "result": message})
+        if api_method == "setWebhook":
+            self.webhook = (params["url"], params.get("secret_token"))
+            return _json({"ok": True, "result": True})
+        if api_method == "deleteWebhook":
+            self.webhook = None
+            return _json({"ok": True, "result": True})
+        if api_method == "getWebhookInfo":
+            url = self.webhook[0] if self.webhook else ""
+            return _json({"ok": True, "result": {"url": url, "has_custom_certificate": False, "pending_update_count": len(self._updates)}})
+        if api_method in ("sendChatAction", "setMyCommands", "close", "logOut"):
+            return _json({"ok": True, "result": True})
+        return _json({"ok": False, "error_code": 404, "description": f"Not Found: method {api_method}"}, status=404)
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        # Confirmed updates are dropped, like the real API does
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+
+class FakeOpenWeather(FakeHTTPServer):
+    """
+    OpenWeatherMap current-weather stand-in; answers every city with a
+    plausible reading. Point services.OPENWEATHER_URL at self.weather_url.
+    """
+
+    CONDITIONS = ("Clear", "Clouds", "Rain", "Haze")
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, seed=0):
+        super().__init__(host, port, latency)
+        self._random = random.Random(seed)
+
+    @property
+    def weather_url(self):
+        return f"{self.url}/data/2.5/weather"
+
+    async def handle(self, method, path, query, headers, body):
+        if path != "/data/2.5/weather":
+            return _json({"cod": "404", "message": "Internal error"}, status=404)
+        city = query.get("q", [""])[-1]
+        if not city:
+            return _json({"cod": "400", "message": "Nothing to geocode"}, status=400)
+        temp = round(self._random.uniform(18, 38), 2)
+        return _json({
+            "weather": [{"main": self._random.choice(self.CONDITIONS)}],
+            "main": {"temp": temp, "feels_like": round(temp + self._random.uniform(-2, 3), 2), "humidity": self._random.randint(30, 95)},
+            "name": city.split(",")[0],
+        })
+
+
+class FakeAgrowon(FakeHTTPServer):
+    """
+    Agrowon category pages with `headlines` stories each, padded to roughly
+    `page_size` bytes like the real (script-heavy) pages. Use sources() in
+    place of mapping.NEWS_SOURCES and set services.AGROWON_BASE_URL to self.url.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, headlines=10, page_size=200_000):
+        super().__init__(host, port, latency)
+        self.headlines = headlines
+        self.page_size = page_size
+
+    def sources(self, categories=("हवामान बातम्या", "कृषी बातम्या")):
+        return {category: f"{self.url}/category-{i}" for i, category in enumerate(categories)}
+
+    async def handle(self, method, path, query, headers, body):
+        slug = path.strip("/") or "home"
+        stories = "".join(
+            f'<div class="card"><a href="/{slug}/story-{i}"><h6 class="headline-m_headline__x{i % 7}">'
+            f"{slug} headline {i}</h6></a><p>Summary of story {i}.</p></div>"
+            for i in range(self.headlines)
+        )
+        page = f"<html><head><title>{slug}</title></head><body>{stories}</body></html>"
+        filler = max(self.page_size - len(page), 0)
+        # Padding goes in a script block, which the headline parser has to skip over
+        page = page.replace("</head>", f"<script>var pad='{'x' * filler}';</script></head>")
+        return 200, "text/html; charset=utf-8", page.encode("utf-8")
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Resolver Configuration ---
+NGRAM_SIZE = 3
+NGRAM_MIN_SCORE = 0.6  # Dice similarity of character trigrams
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+EMBEDDING_MIN_SCORE = 0.6  # Cosine similarity
+EMBEDDING_CACHE_FILE = "item_embeddings.npz"
+
+_SPACES = re.compile(r"[\s_]+")
+
+
+def normalize(text):
+    """Lower-cases, trims and collapses whitespace/underscores so 'Dudhi_Bhopla ' == 'dudhi bhopla'."""
+    return _SPACES.sub(" ", str(text).lower()).strip()
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    padded = f"${text}$"
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class _NgramIndex:
+    """Inverted index of character n-grams over candidate spellings."""
+    __slots__ = ("targets", "sizes", "postings")
+
+    def __init__(self, candidates):
+        # candidates: {normalized spelling: item name}
+        self.targets = []
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for idx, (spelling, target) in enumerate(candidates.items()):
+            grams = char_ngrams(spelling)
+            self.targets.append(target)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(idx)
+
+    def best(self, text, min_score=NGRAM_MIN_SCORE):
+        """Returns (item name, score) of the closest candidate, or (None, 0.0)."""
+        grams = char_ngrams(text)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                overlap[idx] += 1
+        best_idx, best_score = None, 0.0
+        for idx, shared in overlap.items():
+            score = 2.0 * shared / (len(grams) + self.sizes[idx])
+            if score > best_score:
+                best_idx, best_score = idx, score
+        if best_idx is None or best_score < min_score:
+            return None, 0.0
+        return self.targets[best_idx], best_score
+
+
+class ItemResolver:
+    """
+    Maps what a user typed to an item name in the price data, cheapest stage first:
+      1. exact dict lookup of ITEM_MAPPING_CONFIG keys and item names,
+      2. character n-gram similarity (typos, plurals, Devanagari spelling variants),
+      3. sentence embeddings, loaded only when both cheaper stages miss.
+    """
+
+    def __init__(self, item_mapping, item_names=(), embedding_cache=None, model_name=EMBEDDING_MODEL):
+        self.item_mapping = item_mapping
+        self.embedding_cache = embedding_cache
+        self.model_name = model_name
+        self._model = None
+        self._embeddings = None  # (digest of candidate keys, (keys, targets, matrix))
+        self._model_lock = threading.Lock()
+        self.update_items(item_names)
+
+    def update_items(self, item_names):
+        """Rebuilds the lookup tables for a new set of loaded item names (e.g. after a data reload)."""
+        names = frozenset(item_names)
+        candidates = {}
+        for key, marathi in self.item_mapping.items():
+            candidates.setdefault(normalize(key), marathi)
+            candidates.setdefault(normalize(marathi), marathi)
+        for name in names:
+            candidates[normalize(name)] = name
+        # Mapping targets that are spelled differently in the data, e.g. 'बेबी कॉर्न' vs 'बेबी काॅर्न'
+        names_index = _NgramIndex({normalize(name): name for name in names})
+        for spelling, target in candidates.items():
+            if names and target not in names:
+                candidates[spelling] = names_index.best(normalize(target))[0] or target
+        # Swap in one assignment so lookups from other threads see a consistent snapshot
+        self._tables = (candidates, _NgramIndex(candidates), names)
+
+    def spellings(self):
+        """{normalized spelling: item name} for every known spelling, e.g. to build a keyword index."""
+        return dict(self._tables[0])
+
+    def resolve(self, text):
+        """Exact and n-gram stages only; returns an item name or None. Cheap enough for every message."""
+        exact, ngrams, _ = self._tables
+        query = normalize(text)
+        if not query:
+            return None
+        hit = exact.get(query)
+        if hit is not None:
+            return hit
+        return ngrams.best(query)[0]
+
+    def resolve_semantic(self, text, min_score=EMBEDDING_MIN_SCORE):
+        """
+        Embedding stage; blocking and slow on first use (imports torch and loads the model).
+        Callers on the event loop should run it in a worker thread.
+        """
+        query = normalize(text)
+        if not query:
+            return None
+        keys, targets, matrix = self._embedding_matrix()
+        if not keys:
+            return None
+        model = self._load_model()
+        vector = model.encode([query], normalize_embeddings=True, convert_to_numpy=True)[0]
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        logger.info(f"Semantic match for '{query}': '{keys[best]}' ({scores[best]:.2f})")
+        if scores[best] < min_score:
+            return None
+        return targets[best]
+
+    def _load_model(self):
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Loading embedding model '{self.model_name}'...")
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    def precompute_embeddings(self):
+        """Builds (or tops up) the on-disk embedding matrix ahead of time; returns the number of spellings."""
+        return len(self._embedding_matrix()[0])
+
+    def _embedding_matrix(self):
+        """Normalized embeddings of every candidate spelling, reusing the on-disk matrix where possible."""
+        candidates = self._tables[0]
+        keys = sorted(candidates)
+        digest = hashlib.sha1("\n".join([self.model_name] + keys).encode("utf-8")).hexdigest()
+        cached = self._embeddings
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+
+        known = self._read_embedding_cache()
+        missing = [key for key in keys if key not in known]
+        if missing:
+            logger.info(f"Embedding {len(missing)} new item spellings...")
+            vectors = self._load_model().encode(missing, normalize_embeddings=True, convert_to_numpy=True)
+            known.update(zip(missing, vectors.astype(np.float32)))
+            self._write_embedding_cache(keys, known)
+
+        matrix = np.stack([known[key] for key in keys]) if keys else np.zeros((0, 1), dtype=np.float32)
+        result = (keys, [candidates[key] for key in keys], matrix)
+        self._embeddings = (digest, result)
+        return result
+
+    def _read_embedding_cache(self):
+        if not self.embedding_cache or not os.path.exists(self.embedding_cache):
+            return {}
+        try:
+            with np.load(self.embedding_cache, allow_pickle=False) as snap:
+                if str(snap["model"]) != self.model_name:
+                    return {}
+                return dict(zip(snap["keys"].tolist(), snap["vectors"]))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding cache {self.embedding_cache}: {e}")
+            return {}
+
+    def _write_embedding_cache(self, keys, vectors):
+        if not self.embedding_cache:
+            return
+        try:
+            cache_dir = os.path.dirname(self.embedding_cache) or "."
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                np.savez(
+                    fh,
+                    model=np.asarray(self.model_name),
+                    keys=np.asarray(keys, dtype=str),
+                    vectors=np.stack([vectors[key] for key in keys]).astype(np.float32),
+                )
+            os.replace(tmp_path, self.embedding_cache)
+        except OSError as e:
+            logger.warning(f"Could not write embedding cache {self.embedding_cache}: {e}")
+
+
+if __name__ == "__main__":
+    # Precompute the embedding matrix so the first semantic lookup in production only encodes the query
+    import sys
+
+    import mapping
+    from priceStore import PriceStore, SNAPSHOT_DIR_NAME
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "priceData"
+    store = PriceStore(data_dir)
+    resolver = ItemResolver(
+        mapping.ITEM_MAPPING_CONFIG,
+        store.load(),
+        embedding_cache=os.path.join(data_dir, SNAPSHOT_DIR_NAME, EMBEDDING_CACHE_FILE),
+    )
+    logger.info(f"Embedded {resolver.precompute_embeddings()} item spellings.")
@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Metrics Configuration ---
+# Upper bounds (seconds) of the latency buckets; +Inf is implied. In-process stages
+# (parse, resolve, format) take tens of microseconds, so the low end is fine-grained.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DATA_LOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REQUEST_TIMEOUT = 5.0  # seconds a scrape connection may take to send its request
+
+
+class _Value:
+    """One counter or gauge series."""
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Reads the value from function() whenever it is collected, e.g. len(sessions)."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _HistogramValue:
+    """One histogram series: per-bucket counts (not cumulative), sum and count."""
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)  # first bucket with value <= bound
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager that observes the duration of its block in seconds."""
+        return _Timer(self)
+
+    def mean(self):
+        """Average observation, or None before the first one (a timed block may still be running)."""
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating inside its bucket, like PromQL's histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen, lower = 0, 0.0
+        for index, bucket_count in enumerate(self.counts[:-1]):
+            upper = self.bounds[index]
+            if bucket_count and seen + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.bounds[-1]  # in the +Inf bucket: the largest finite bound is all we know
+
+
+class Metric:
+    """A named metric with optional labels; each combination of label values is its own series."""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind  # "counter", "gauge" or "histogram"
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The series for these label values (in labelnames order), created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, _HistogramValue(self.buckets) if self.kind == "histogram" else _Value())
+        return child
+
+    def series(self):
+        """[(label values, series)] in creation order."""
+        return list(self._children.items())
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def collect(self):
+        """Lines of the Prometheus text format for this metric."""
+        lines = [f"# HELP {self.name} {_escape_help(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.series():
+            labels = list(zip(self.labelnames, values))
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_labels(labels)} {_number(child.get())}")
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(labels + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {child.count}")
+        return lines
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """The set of metrics exported by this process."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Metric("counter", name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Metric("gauge", name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Metric("histogram", name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Bot Metrics ---
+STAGE_SECONDS = REGISTRY.histogram("agribot_stage_seconds", "Time spent in each stage of answering a message.", ["stage"])
+UPSTREAM_SECONDS = REGISTRY.histogram("agribot_upstream_request_seconds", "Duration of requests to upstream services.", ["service"])
+UPSTREAM_ERRORS = REGISTRY.counter("agribot_upstream_errors_total", "Failed requests to upstream services.", ["service"])
+CACHE_REQUESTS = REGISTRY.counter("agribot_cache_requests_total", "Cache lookups by cache and result (hit, stale or miss).", ["cache", "result"])
+MESSAGES = REGISTRY.counter("agribot_messages_total", "Messages answered, by detected intent.", ["intent"])
+THROTTLED = REGISTRY.counter("agribot_throttled_messages_total", "Messages dropped by the per-user rate limiter.")
+HANDLER_ERRORS = REGISTRY.counter("agribot_handler_errors_total", "Messages that failed with an unexpected error.")
+DATA_LOAD_SECONDS = REGISTRY.histogram("agribot_data_load_seconds", "Duration of price data loads (startup) and reloads.", ["kind"], DATA_LOAD_BUCKETS)
+DATA_ITEMS = REGISTRY.gauge("agribot_data_items", "Items in the loaded price data.")
+DATA_VERSION = REGISTRY.gauge("agribot_data_version", "Price store version; increases with every reload.")
+SESSIONS = REGISTRY.gauge("agribot_sessions", "User sessions held in memory.")
+START_TIME = REGISTRY.gauge("agribot_start_time_seconds", "Unix time at which the process started.")
+START_TIME.set(time.time())
+
+
+def stage(name):
+    """Times a block as one stage of message handling: `with metrics.stage("parse"): ...`."""
+    return STAGE_SECONDS.labels(name).time()
+
+
+# --- Metrics Endpoint ---
+
+async def _serve(registry, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        while await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT) not in (b"\r\n", b"\n", b""):
+            pass
+        method, path = (request_line.decode("latin-1").split() + ["", ""])[:2]
+        if method in ("GET", "HEAD") and path.split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE, registry.render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+        head = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        writer.write(head.encode("latin-1") + (body if method != "HEAD" else b""))
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Serves the registry at http://host:port/metrics for Prometheus; returns the asyncio.Server."""
+    server = await asyncio.start_server(lambda reader, writer: _serve(registry, reader, writer), host, port)
+    logger.info(f"Metrics available at http://{host}:{server.sockets[0].getsockname()[1]}/metrics")
+    return server
@@ -0,0 +1,458 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --- Workbook Format ---
+FILE_PREFIX = "Pune_Market_Rates_"
+FILE_SUFFIX = ".xlsx"
+DATE_FORMAT = "%d-%m-%Y"
+# Source column -> column name used in the store
+COLUMN_MAP = {
+    "शेतिमाल": "item",
+    "Date": "date",
+    "किमान": "min_rate",
+    "कमाल": "max_rate",
+    "Market": "market",
+    "परिमाण": "quantity",
+}
+REQUIRED_COLUMNS = set(COLUMN_MAP)
+STORE_COLUMNS = list(COLUMN_MAP.values())
+
+# --- Snapshot Configuration ---
+# Parsed workbooks are cached as .npz files next to the data so a restart
+# only re-reads workbooks whose name, size or mtime changed.
+SNAPSHOT_DIR_NAME = ".snapshots"
+SNAPSHOT_VERSION = 1
+
+
+def is_price_file(filename):
+    return filename.startswith(FILE_PREFIX) and filename.endswith(FILE_SUFFIX)
+
+
+def file_signature(filepath):
+    """(size, mtime_ns) of a file; changes whenever the workbook is rewritten."""
+    st = os.stat(filepath)
+    return st.st_size, st.st_mtime_ns
+
+
+def _parse_rate(column):
+    """Turns strings like 'Rs. 6000/-' into floats, NaN when no rate is given."""
+    digits = column.astype(str).str.replace(",", "", regex=False).str.extract(r"(\d+(?:\.\d+)?)", expand=False)
+    return pd.to_numeric(digits, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def parse_workbook(filepath):
+    """
+    Reads one market-rate workbook into a frame with STORE_COLUMNS.
+    Returns None if the file does not have the expected columns.
+    """
+    df = pd.read_excel(filepath, dtype=str)
+    if not REQUIRED_COLUMNS.issubset(df.columns):
+        logger.warning(f"Skipping {filepath}: Incomplete data format. Missing columns: {REQUIRED_COLUMNS - set(df.columns)}")
+        return None
+
+    items = df["शेतिमाल"].str.strip()
+    dates = pd.to_datetime(df["Date"].str.strip(), format=DATE_FORMAT, errors="coerce")
+    valid = items.notna() & (items != "") & dates.notna()
+    dropped = int((~valid).sum())
+    if dropped:
+        logger.warning(f"Skipping {dropped} rows in {filepath}: invalid date or empty item name.")
+
+    return pd.DataFrame({
+        "item": items[valid].to_numpy(dtype=str),
+        "date": dates[valid].to_numpy(dtype="datetime64[D]"),
+        "min_rate": _parse_rate(df.loc[valid, "किमान"]),
+        "max_rate": _parse_rate(df.loc[valid, "कमाल"]),
+        "market": df.loc[valid, "Market"].fillna("N/A").to_numpy(dtype=str),
+        "quantity": df.loc[valid, "परिमाण"].fillna("").to_numpy(dtype=str),
+    })
+
+
+# Aggregates over the rows of one item between two dates (both inclusive)
+# `rows` counts every listed day; traded_min/traded_max only the days with a min/max rate
+RangeSummary = namedtuple("RangeSummary", ["first_date", "last_date", "rows", "traded_min", "traded_max", "avg_min", "avg_max", "low", "high"])
+
+
+def _sparse_table(values, op):
+    """Level k holds op over every window of 2**k rows, so any range query is two lookups."""
+    table = [values]
+    width = 1
+    while width * 2 <= len(values):
+        prev = table[-1]
+        table.append(op(prev[:-width], prev[width:]))
+        width *= 2
+    return table
+
+
+def _sparse_query(table, op, i, j):
+    """op over values[i:j] (j > i) in O(1)."""
+    level = (j - i).bit_length() - 1
+    return op(table[level][i], table[level][j - (1 << level)])
+
+
+class _Aggregates:
+    """Prefix sums and range-min/max tables of one ItemSeries; NaN rates are left out."""
+    __slots__ = ("sum_min", "sum_max", "count_min", "count_max", "lows", "highs")
+
+    def __init__(self, min_rate, max_rate):
+        has_min = ~np.isnan(min_rate)
+        has_max = ~np.isnan(max_rate)
+        self.sum_min = np.concatenate(([0.0], np.cumsum(np.where(has_min, min_rate, 0.0))))
+        self.sum_max = np.concatenate(([0.0], np.cumsum(np.where(has_max, max_rate, 0.0))))
+        self.count_min = np.concatenate(([0], np.cumsum(has_min)))
+        self.count_max = np.concatenate(([0], np.cumsum(has_max)))
+        self.lows = _sparse_table(np.where(has_min, min_rate, np.inf), np.minimum)
+        self.highs = _sparse_table(np.where(has_max, max_rate, -np.inf), np.maximum)
+
+
+class ItemSeries:
+    """Full price history of one commodity as parallel arrays, oldest date first."""
+    __slots__ = ("item", "dates", "min_rate", "max_rate", "market", "quantity", "version", "_aggregates")
+
+    def __init__(self, item, dates, min_rate, max_rate, market, quantity, version=0):
+        self.item = item
+        self.version = version  # PriceStore.version this series was built in; keys caches of derived output
+        self.dates = dates
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.market = market
+        self.quantity = quantity
+        self._aggregates = None  # built on the first range query
+
+    def __len__(self):
+        return len(self.dates)
+
+    def latest(self, n=5, until=None):
+        """
+        Returns the newest n rows as (date, min_rate, max_rate, market, quantity), newest first.
+        With `until` (a date), only rows on or before that day are considered.
+        """
+        end = len(self.dates)
+        if until is not None:
+            end = int(np.searchsorted(self.dates, np.datetime64(until, "D"), side="right"))
+        start = max(end - n, 0)
+        if start >= end:
+            return []
+        rows = slice(end - 1, start - 1 if start else None, -1)
+        return list(zip(
+            self.dates[rows].tolist(),
+            self.min_rate[rows].tolist(),
+            self.max_rate[rows].tolist(),
+            self.market[rows].tolist(),
+            self.quantity[rows].tolist(),
+        ))
+
+    @property
+    def last_date(self):
+        return self.dates[-1].item() if len(self.dates) else None
+
+    def summarize(self, start, end):
+        """
+        RangeSummary of the rows dated start..end (inclusive), or None if there are none.
+        Two binary searches plus O(1) prefix-sum and sparse-table lookups; rows are never scanned.
+        """
+        i = int(np.searchsorted(self.dates, np.datetime64(start, "D"), side="left"))
+        j = int(np.searchsorted(self.dates, np.datetime64(end, "D"), side="right"))
+        if i >= j:
+            return None
+        agg = self._aggregates
+        if agg is None:
+            agg = self._aggregates = _Aggregates(self.min_rate, self.max_rate)
+
+        count_min = int(agg.count_min[j] - agg.count_min[i])
+        count_max = int(agg.count_max[j] - agg.count_max[i])
+        low = float(_sparse_query(agg.lows, np.minimum, i, j))
+        high = float(_sparse_query(agg.highs, np.maximum, i, j))
+        return RangeSummary(
+            first_date=self.dates[i].item(),
+            last_date=self.dates[j - 1].item(),
+            rows=j - i,
+            traded_min=count_min,
+            traded_max=count_max,
+            avg_min=float(agg.sum_min[j] - agg.sum_min[i]) / count_min if count_min else float("nan"),
+            avg_max=float(agg.sum_max[j] - agg.sum_max[i]) / count_max if count_max else float("nan"),
+            low=low if count_min else float("nan"),
+            high=high if count_max else float("nan"),
+        )
+
+
+def frame_arrays(frame):
+    """Plain (pickle-free) NumPy arrays for each store column of a frame."""
+    return {
+        "item": np.asarray(frame["item"].to_numpy(), dtype=str),
+        "date": frame["date"].to_numpy(dtype="datetime64[D]"),
+        "min_rate": frame["min_rate"].to_numpy(dtype=np.float64),
+        "max_rate": frame["max_rate"].to_numpy(dtype=np.float64),
+        "market": np.asarray(frame["market"].to_numpy(), dtype=str),
+        "quantity": np.asarray(frame["quantity"].to_numpy(), dtype=str),
+    }
+
+
+def _take(columns, rows):
+    """The given rows (index array or mask) of every column."""
+    return {name: values[rows] for name, values in columns.items()}
+
+
+def _concat_columns(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def _merge_same_day(columns):
+    """
+    Collapses rows with the same item, date and market (already sorted together) into one.
+    The APMC sheets list some items under several codes a day, usually with the price on
+    only one of them, so a priced row always beats an empty one and priced rows are
+    combined into the lowest minimum and highest maximum rate.
+    """
+    keys = [columns[name] for name in ("item", "date", "market") if name in columns]
+    count = len(keys[0])
+    if count < 2:
+        return columns
+    new_group = np.zeros(count - 1, dtype=bool)
+    for key in keys:
+        new_group |= key[1:] != key[:-1]
+    starts = np.flatnonzero(np.concatenate(([True], new_group)))
+    if len(starts) == count:
+        return columns
+
+    min_rate, max_rate = columns["min_rate"], columns["max_rate"]
+    # Item name, market and quantity come from the group's first priced row (or its first row)
+    priced = ~(np.isnan(min_rate) & np.isnan(max_rate))
+    rows = np.arange(count)
+    first_priced = np.minimum.reduceat(np.where(priced, rows, count), starts)
+    representative = np.where(first_priced < count, first_priced, starts)
+
+    merged = _take(columns, representative)
+    with np.errstate(invalid="ignore"):
+        merged["min_rate"] = np.fmin.reduceat(min_rate, starts)
+        merged["max_rate"] = np.fmax.reduceat(max_rate, starts)
+    return merged
+
+
+def build_series(columns, version=0):
+    """Groups STORE_COLUMNS arrays (see frame_arrays) into {item: ItemSeries} without per-row Python work."""
+    if not len(columns["item"]):
+        return {}
+    order = np.lexsort((columns["market"], columns["date"], columns["item"]))  # stable
+    columns = _merge_same_day(_take(columns, order))
+    items = columns["item"]
+    names, starts = np.unique(items, return_index=True)
+    ends = np.append(starts[1:], len(items))
+
+    series = {}
+    for name, start, end in zip(names.tolist(), starts, ends):
+        series[name] = ItemSeries(
+            name,
+            columns["date"][start:end],
+            columns["min_rate"][start:end],
+            columns["max_rate"][start:end],
+            columns["market"][start:end],
+            columns["quantity"][start:end],
+            version,
+        )
+    return series
+
+
+def merge_series(old, new, version=0):
+    """
+    ItemSeries with the rows of `new` added to `old` (same item). Rows dated after
+    old's last day are simply appended; otherwise the two are interleaved by date and
+    any day present in both is merged like duplicate rows of one workbook.
+    """
+    columns = {
+        "date": np.concatenate((old.dates, new.dates)),
+        "min_rate": np.concatenate((old.min_rate, new.min_rate)),
+        "max_rate": np.concatenate((old.max_rate, new.max_rate)),
+        "market": np.concatenate((old.market, new.market)),
+        "quantity": np.concatenate((old.quantity, new.quantity)),
+    }
+    if len(old) and len(new) and new.dates[0] <= old.dates[-1]:
+        if np.isin(new.dates, old.dates).any():
+            columns = _merge_same_day(_take(columns, np.lexsort((columns["market"], columns["date"]))))
+        else:
+            columns = _take(columns, np.argsort(columns["date"], kind="stable"))
+    return ItemSeries(old.item, columns["date"], columns["min_rate"], columns["max_rate"],
+                      columns["market"], columns["quantity"], version)
+
+
+class PriceStore:
+    """
+    Loads every market-rate workbook in data_dir into per-item ItemSeries,
+    using .npz snapshots so unchanged workbooks are never parsed twice.
+    """
+
+    def __init__(self, data_dir, snapshot_dir=None):
+        self.data_dir = data_dir
+        self.snapshot_dir = snapshot_dir or os.path.join(data_dir, SNAPSHOT_DIR_NAME)
+        self.series = {}
+        self.version = 0  # bumped every time self.series is swapped
+        # filename -> (signature, frozenset of its items); the rows themselves live only in
+        # self.series and the snapshots, which are re-read when a workbook changes or goes away
+        self._files = {}
+        self._failed = {}  # filename -> signature of a workbook that could not be parsed
+        self._refresh_lock = threading.Lock()
+
+    def _snapshot_path(self, filename):
+        return os.path.join(self.snapshot_dir, filename + ".npz")
+
+    def _read_snapshot(self, filename, signature):
+        path = self._snapshot_path(filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as snap:
+                if int(snap["version"]) != SNAPSHOT_VERSION or tuple(snap["signature"].tolist()) != signature:
+                    return None
+                return {name: snap[name] for name in STORE_COLUMNS}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+            return None
+
+    def _write_snapshot(self, filename, signature, columns):
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                np.savez(
+                    fh,
+                    version=np.int64(SNAPSHOT_VERSION),
+                    signature=np.asarray(signature, dtype=np.int64),
+                    **columns,
+                )
+            os.replace(tmp_path, self._snapshot_path(filename))
+        except OSError as e:
+            logger.warning(f"Could not write snapshot for {filename}: {e}")
+
+    def _prune_snapshots(self, filenames):
+        """Removes snapshots whose source workbook is no longer in data_dir."""
+        if not os.path.isdir(self.snapshot_dir):
+            return
+        for snap_name in os.listdir(self.snapshot_dir):
+            source = snap_name[:-len(".npz")]
+            if snap_name.endswith(".npz") and is_price_file(source) and source not in filenames:
+                try:
+                    os.remove(os.path.join(self.snapshot_dir, snap_name))
+                except OSError as e:
+                    logger.warning(f"Could not remove stale snapshot {snap_name}: {e}")
+
+    def _load_file(self, filename, signature):
+        """Returns the STORE_COLUMNS arrays of one workbook, from its snapshot when it is still valid."""
+        columns = self._read_snapshot(filename, signature)
+        if columns is not None:
+            logger.info(f"Loaded {filename} from snapshot ({len(columns['item'])} rows).")
+            return columns
+        filepath = os.path.join(self.data_dir, filename)
+        frame = parse_workbook(filepath)
+        if frame is None:
+            return None
+        columns = frame_arrays(frame)
+        logger.info(f"Parsed {filename} ({len(frame)} rows).")
+        self._write_snapshot(filename, signature, columns)
+        return columns
+
+    def _try_load_file(self, filename, signature):
+        try:
+            return self._load_file(filename, signature)
+        except Exception as e:
+            logger.error(f"Error reading {os.path.join(self.data_dir, filename)}: {e}")
+            return None
+
+    def scan(self):
+        """Returns {filename: signature} for every market-rate workbook currently in data_dir."""
+        signatures = {}
+        for filename in sorted(os.listdir(self.data_dir)):
+            if not is_price_file(filename):
+                continue
+            try:
+                signatures[filename] = file_signature(os.path.join(self.data_dir, filename))
+            except OSError as e:  # removed between listdir and stat
+                logger.warning(f"Could not stat {filename}: {e}")
+        return signatures
+
+    def refresh(self):
+        """
+        Parses only workbooks that were added or modified since the last call and swaps in
+        a new self.series. Rows of a new workbook are merged into the existing series of
+        their items; items that lost rows (a workbook was rewritten or removed) are rebuilt
+        from the snapshots of the workbooks that still contain them.
+        Returns True if the data changed. Safe to call from a worker thread:
+        readers keep using the previous dict until the swap.
+        """
+        with self._refresh_lock:
+            if not os.path.isdir(self.data_dir):
+                logger.error(f"Data directory '{self.data_dir}' not found. Please create it and add your Excel files.")
+                return False
+
+            signatures = self.scan()
+            removed = [name for name in self._files if name not in signatures]
+            changed = {}
+            for filename, signature in signatures.items():
+                known = self._files.get(filename)
+                if (known and known[0] == signature) or self._failed.get(filename) == signature:
+                    continue
+                columns = self._try_load_file(filename, signature)
+                if columns is None:
+                    # Don't retry a broken workbook until it is rewritten
+                    self._failed[filename] = signature
+                    if known:
+                        removed.append(filename)
+                    continue
+                self._failed.pop(filename, None)
+                changed[filename] = (signature, columns)
+
+            if not changed and not removed:
+                return False
+
+            version = self.version + 1
+            rebuild = set()
+            for filename in removed + list(changed):
+                if filename in self._files:
+                    rebuild.update(self._files[filename][1])
+
+            files = {name: entry for name, entry in self._files.items() if name not in removed}
+            for filename, (signature, columns) in changed.items():
+                files[filename] = (signature, frozenset(np.unique(columns["item"]).tolist()))
+            files = dict(sorted(files.items()))
+
+            series = {item: s for item, s in self.series.items() if item not in rebuild}
+            if rebuild:
+                wanted = list(rebuild)
+                parts = []
+                for filename, (signature, items) in files.items():
+                    if items.isdisjoint(rebuild):
+                        continue
+                    columns = changed[filename][1] if filename in changed else self._try_load_file(filename, signature)
+                    if columns is not None:
+                        parts.append(_take(columns, np.isin(columns["item"], wanted)))
+                if parts:
+                    series.update(build_series(_concat_columns(parts), version))
+
+            extended = 0
+            parts = [columns if not rebuild else _take(columns, ~np.isin(columns["item"], list(rebuild)))
+                     for _, columns in changed.values()]
+            if parts:
+                for item, new in build_series(_concat_columns(parts), version).items():
+                    old = series.get(item)
+                    series[item] = new if old is None else merge_series(old, new, version)
+                    extended += old is not None
+
+            self._prune_snapshots(signatures)
+            self._files = files
+            # Single reference assignment: concurrent readers see the old or the new dict, never a mix.
+            self.series = series
+            self.version = version
+            logger.info(f"Price data v{self.version}: {len(changed)} workbook(s) merged, {len(removed)} removed, "
+                        f"{len(rebuild)} item(s) rebuilt, {extended} extended.")
+            return True
+
+    def load(self):
+        """Loads the whole directory (or whatever changed since the last call) and returns self.series."""
+        self.refresh()
+        return self.series
@@ -0,0 +1,242 @@
+import re
+from datetime import date, datetime, timedelta
+
+# --- Intents ---
+RATE = "rate"
+WEATHER = "weather"
+NEWS = "news"
+
+# --- Statistics over a date range (rate intent) ---
+TREND = "trend"
+AVERAGE = "average"
+MINMAX = "minmax"
+CHANGE = "change"
+
+MAX_ITEMS_PER_QUERY = 5
+
+# --- Precompiled Patterns ---
+# Tokens are split on whitespace and punctuation only; \w would break Devanagari vowel signs apart.
+TOKEN_SPLIT = re.compile(r"[\s,.;:!?()\[\]{}'\"/\\|+&*\-–—।॥]+")
+_SPACES = re.compile(r"\s+")
+# day-month[-year]; with "." the year is required, so decimals like "1.5" are not dates
+_DATE = r"(\d{1,2})(?:[-/]|\.(?=\d{1,2}\.\d{2,4}))(\d{1,2})(?:[-/.](\d{2,4}))?"
+DATE_RANGE_PATTERN = re.compile(rf"\b(?:from|between)\s+{_DATE}\s+(?:to|and|till|until|-)\s+{_DATE}\b")
+DATE_PATTERN = re.compile(rf"\b(?:(?:on|for)\s+)?(?:date\s+)?{_DATE}\b")
+RELATIVE_DAY_PATTERN = re.compile(r"\b(?:(?:on|for)\s+)?(today|yesterday)\b")
+LAST_N_PATTERN = re.compile(r"\b(?:in\s+|for\s+|over\s+)?(?:the\s+)?(?:last|past|previous)\s+(\d{1,4})?\s*(day|week|month|year)s?\b")
+WEEK_OVER_WEEK_PATTERN = re.compile(r"\b(?:week\s*(?:over|on|to|vs)\s*week|wow|w/w)\b")
+THIS_PERIOD_PATTERN = re.compile(r"\b(?:in\s+|for\s+)?(this|current)\s+(week|month|year)\b")
+
+# Words that select an intent; matched per token through set lookups.
+INTENT_KEYWORDS = {
+    "rate": RATE, "rates": RATE, "price": RATE, "prices": RATE, "bhav": RATE, "भाव": RATE, "दर": RATE,
+    "weather": WEATHER, "mausam": WEATHER, "हवामान": WEATHER,
+    "news": NEWS, "बातमी": NEWS, "बातम्या": NEWS,
+}
+STAT_KEYWORDS = {
+    "trend": TREND, "trends": TREND, "trending": TREND, "history": TREND,
+    "average": AVERAGE, "avg": AVERAGE, "mean": AVERAGE, "सरासरी": AVERAGE,
+    "min": MINMAX, "max": MINMAX, "minimum": MINMAX, "maximum": MINMAX, "lowest": MINMAX, "highest": MINMAX,
+    "change": CHANGE, "compare": CHANGE, "difference": CHANGE,
+}
+# Filler words ignored when looking for item names in the rest of the message.
+STOPWORDS = frozenset({
+    "what", "whats", "is", "are", "the", "a", "an", "of", "for", "on", "in", "at", "to", "me", "show",
+    "tell", "give", "please", "pls", "current", "latest", "today", "todays", "date", "and", "or",
+    "kay", "ahe", "kya", "hai", "ka", "ki", "che", "chi", "cha", "आहे", "काय", "चा", "ची", "चे", "आणि",
+})
+# Separators between several items in one message, e.g. "onion and potato rate".
+ITEM_SEPARATORS = frozenset({"and", "or", "आणि"})
+
+
+def tokenize(text):
+    return [token for token in TOKEN_SPLIT.split(text) if token]
+
+
+def _to_date(day, month, year, today):
+    if not year:
+        # Without a year, mean the most recent such day: "25-12" asked in October is last Christmas
+        result = date(today.year, int(month), int(day))
+        return result if result <= today else date(today.year - 1, int(month), int(day))
+    year = int(year)
+    if year < 100:
+        year += 2000
+    return date(year, int(month), int(day))
+
+
+class ParsedQuery:
+    """Everything the handlers need from one message, so nothing downstream re-parses the text."""
+    __slots__ = ("text", "intent", "keywords", "stat", "items", "unresolved", "cities", "on_date", "date_range")
+
+    def __init__(self, text):
+        self.text = text  # normalized message
+        self.intent = None  # RATE, WEATHER, NEWS or None
+        self.keywords = set()  # intents named explicitly ("rate", "weather", ...)
+        self.stat = None  # TREND, AVERAGE, MINMAX or CHANGE for history questions
+        self.items = []  # item names recognized through the keyword trie
+        self.unresolved = []  # leftover phrases that may still be item names (typos, new spellings)
+        self.cities = []  # CITY entries mentioned in the message
+        self.on_date = None  # a single requested day
+        self.date_range = None  # (start, end), both inclusive
+
+    def __repr__(self):
+        return (f"ParsedQuery(intent={self.intent!r}, keywords={self.keywords!r}, stat={self.stat!r}, items={self.items!r}, unresolved={self.unresolved!r}, "
+                f"cities={self.cities!r}, on_date={self.on_date!r}, date_range={self.date_range!r})")
+
+
+class QueryRouter:
+    """
+    Normalizes a message once and detects intents, cities, dates and item names.
+    Items and cities are found with a token trie, so routing cost depends on the
+    message length rather than on the size of ITEM_MAPPING_CONFIG.
+    """
+
+    def __init__(self, cities, spellings=None):
+        self._cities = self._build_trie({city.split(",")[0].lower(): city for city in cities})
+        self._items = {}
+        self.update_items(spellings or {})
+
+    @staticmethod
+    def _build_trie(phrases):
+        """{phrase: value} -> nested dicts keyed by token; the value sits under the None key."""
+        root = {}
+        for phrase, value in phrases.items():
+            tokens = tokenize(phrase.lower())
+            if not tokens:
+                continue
+            node = root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(None, value)
+        return root
+
+    def update_items(self, spellings):
+        """Rebuilds the item trie from {spelling: item name}, e.g. ItemResolver.spellings()."""
+        self._items = self._build_trie(spellings)
+
+    @staticmethod
+    def _longest_match(trie, tokens, start):
+        """(value, end index) of the longest phrase in `trie` starting at tokens[start], or (None, start)."""
+        node, value, end = trie, None, start
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if None in node:
+                value, end = node[None], i + 1
+        return value, end
+
+    def _extract_dates(self, text, parsed, today):
+        """Pulls date and range phrases out of `text` and returns the remainder."""
+        match = DATE_RANGE_PATTERN.search(text)
+        if match:
+            try:
+                start = _to_date(*match.group(1, 2, 3), today)
+                end = _to_date(*match.group(4, 5, 6), today)
+                parsed.date_range = (min(start, end), max(start, end))
+            except ValueError:
+                pass
+            return text[:match.start()] + " " + text[match.end():]
+
+        match = LAST_N_PATTERN.search(text)
+        if match:
+            count = int(match.group(1) or 1)
+            days = {"day": 1, "week": 7, "month": 30, "year": 365}[match.group(2)] * count
+            days = min(days, (today - date.min).days + 1)  # "last 9999 years" means everything, not an OverflowError
+            parsed.date_range = (today - timedelta(days=days - 1), today)
+            return text[:match.start()] + " " + text[match.end():]
+
+        match = THIS_PERIOD_PATTERN.search(text)
+        if match:
+            period = match.group(2)
+            if period == "week":
+                start = today - timedelta(days=today.weekday())
+            elif period == "month":
+                start = today.replace(day=1)
+            else:
+                start = today.replace(month=1, day=1)
+            parsed.date_range = (start, today)
+            return text[:match.start()] + " " + text[match.end():]
+
+        match = DATE_PATTERN.search(text)
+        if match:
+            try:
+                parsed.on_date = _to_date(*match.group(1, 2, 3), today)
+            except ValueError:
+                pass
+            return text[:match.start()] + " " + text[match.end():]
+
+        match = RELATIVE_DAY_PATTERN.search(text)
+        if match:
+            parsed.on_date = today if match.group(1) == "today" else today - timedelta(days=1)
+            return text[:match.start()] + " " + text[match.end():]
+        return text
+
+    def parse(self, message, today=None):
+        text = _SPACES.sub(" ", str(message).lower().replace("&", " and ")).strip()
+        parsed = ParsedQuery(text)
+        today = today or datetime.now().date()
+        remainder = text
+        match = WEEK_OVER_WEEK_PATTERN.search(remainder)
+        if match:
+            parsed.stat = CHANGE
+            remainder = remainder[:match.start()] + " " + remainder[match.end():]
+        tokens = tokenize(self._extract_dates(remainder, parsed, today))
+
+        intents = parsed.keywords
+        chunk = []  # current run of unrecognized tokens
+
+        def close_chunk():
+            if chunk:
+                parsed.unresolved.append(" ".join(chunk))
+                chunk.clear()
+
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            item, end = self._longest_match(self._items, tokens, i)
+            if item is not None:
+                close_chunk()
+                if item not in parsed.items:
+                    parsed.items.append(item)
+                i = end
+                continue
+            city, end = self._longest_match(self._cities, tokens, i)
+            if city is not None:
+                close_chunk()
+                if city not in parsed.cities:
+                    parsed.cities.append(city)
+                i = end
+                continue
+            intent = INTENT_KEYWORDS.get(token)
+            stat = STAT_KEYWORDS.get(token)
+            if intent is not None:
+                intents.add(intent)
+                close_chunk()
+            elif stat is not None:
+                parsed.stat = parsed.stat or stat
+                close_chunk()
+            elif token in STOPWORDS or token.isdigit():
+                if token in ITEM_SEPARATORS:
+                    close_chunk()
+            else:
+                chunk.append(token)
+            i += 1
+        close_chunk()
+
+        del parsed.items[MAX_ITEMS_PER_QUERY:]
+        del parsed.unresolved[max(MAX_ITEMS_PER_QUERY - len(parsed.items), 0):]
+
+        # Same precedence as before: weather, then news, then rates
+        if WEATHER in intents:
+            parsed.intent = WEATHER
+        elif NEWS in intents:
+            parsed.intent = NEWS
+        elif RATE in intents or parsed.stat or parsed.items:
+            # Leftover words alone ("hello", "thanks") are not a rate question; the
+            # caller may still recognise an item among them, see AgriBot.respond_to_query
+            parsed.intent = RATE
+        elif parsed.cities and not parsed.unresolved:
+            # A bare city name ("Nashik") is a weather question
+            parsed.intent = WEATHER
+        return parsed
@@ -0,0 +1,240 @@
+import asyncio
+import html
+import logging
+import re
+import time
+from typing import Optional
+
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Upstream Configuration ---
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+AGROWON_BASE_URL = "https://agrowon.esakal.com"
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
+
+# Per-request timeouts (seconds). Weather answers are small, news pages are not.
+WEATHER_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+NEWS_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+
+def create_http_client():
+    """One pooled client shared by every upstream call; keep-alive connections are reused across messages."""
+    return httpx.AsyncClient(
+        headers={'User-Agent': USER_AGENT},
+        limits=HTTP_LIMITS,
+        timeout=NEWS_TIMEOUT,
+        follow_redirects=True,
+    )
+
+
+async def fetch_weather(client: httpx.AsyncClient, city: str, api_key: str) -> Optional[dict]:
+    """Returns the OpenWeatherMap current-weather JSON for one city, or None on any error."""
+    try:
+        with metrics.UPSTREAM_SECONDS.labels("openweather").time():
+            response = await client.get(
+                OPENWEATHER_URL,
+                params={"q": city, "appid": api_key, "units": "metric"},
+                timeout=WEATHER_TIMEOUT,
+            )
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to fetch weather for {city}: {e!r}")
+        metrics.UPSTREAM_ERRORS.labels("openweather").inc()
+        return None
+    if response.status_code != 200:
+        logger.warning(f"Could not fetch weather info for {city}: HTTP {response.status_code}")
+        metrics.UPSTREAM_ERRORS.labels("openweather").inc()
+        return None
+    try:
+        return response.json()
+    except ValueError as e:
+        logger.error(f"Invalid weather response for {city}: {e}")
+        metrics.UPSTREAM_ERRORS.labels("openweather").inc()
+        return None
+
+
+class WeatherCache:
+    """
+    Per-city weather readings with a TTL. Concurrent misses for a city share
+    one in-flight request, and a reading older than `ttl` (but younger than
+    `ttl + max_stale`) is served immediately while a background task refreshes it.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, api_key: str, ttl: float, max_stale: float):
+        self.client = client
+        self.api_key = api_key
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries = {}  # city -> (fetched_at, data)
+        self._inflight = {}  # city -> asyncio.Task
+
+    async def get(self, city: str) -> Optional[dict]:
+        entry = self._entries.get(city)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                metrics.CACHE_REQUESTS.labels("weather", "hit").inc()
+                return entry[1]
+            if age < self.ttl + self.max_stale:
+                metrics.CACHE_REQUESTS.labels("weather", "stale").inc()
+                self._refresh(city)  # stale-while-revalidate
+                return entry[1]
+        metrics.CACHE_REQUESTS.labels("weather", "miss").inc()
+        # Shield the shared fetch so one cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(self._refresh(city))
+
+    async def get_many(self, cities: list[str]) -> list[Optional[dict]]:
+        """Readings for several cities, fetched concurrently where needed; keeps the order of `cities`."""
+        return await asyncio.gather(*(self.get(city) for city in cities))
+
+    def _refresh(self, city: str) -> asyncio.Task:
+        """Returns the in-flight fetch for `city`, starting one if none is running."""
+        task = self._inflight.get(city)
+        if task is None:
+            task = asyncio.create_task(self._fetch(city))
+            self._inflight[city] = task
+            task.add_done_callback(lambda done, c=city: self._inflight.pop(c, None) if self._inflight.get(c) is done else None)
+        return task
+
+    async def _fetch(self, city: str) -> Optional[dict]:
+        data = await fetch_weather(self.client, city, self.api_key)
+        if data is not None:
+            self._entries[city] = (time.monotonic(), data)
+            return data
+        # Upstream failed: fall back to the last known reading, however old
+        entry = self._entries.get(city)
+        return entry[1] if entry else None
+
+
+# Only anchors are kept when parsing a news page; the headline <h6> sits inside its link.
+HEADLINE_STRAINER = SoupStrainer("a")
+HEADLINE_CLASS = re.compile(r"headline-m_headline__")
+NO_NEWS_MESSAGE = "Sorry, I couldn't retrieve any news at the moment. Please try again later."
+
+
+def parse_headlines(html: str, category: str, limit: int = 5) -> list[tuple[str, str]]:
+    """Extracts the top (title, link) headlines of an Agrowon category page."""
+    # Parse only the <a> subtrees instead of building a tree for the whole page
+    soup = BeautifulSoup(html, "html.parser", parse_only=HEADLINE_STRAINER)
+
+    # The class name 'headline-m_headline__...' is dynamic, so match on the stable prefix.
+    headlines = []
+    for h6 in soup.find_all("h6", class_=HEADLINE_CLASS, limit=limit * 2):
+        # The link is in the parent 'a' tag of the 'h6'
+        link_tag = h6.find_parent('a')
+        if link_tag and link_tag.get('href'):
+            link = link_tag['href']
+            # Links on the site are relative (e.g., /weather-news/...). We must make them absolute.
+            if not link.startswith('http'):
+                link = f"{AGROWON_BASE_URL}{link}"
+            headlines.append((h6.get_text(strip=True), link))
+            if len(headlines) == limit:
+                break
+
+    if not headlines:
+        logger.warning(f"No headline tags found for '{category}'. The website selector might be outdated.")
+    return headlines
+
+
+async def scrape_news_from_source(client: httpx.AsyncClient, url: str, category: str) -> list[tuple[str, str]]:
+    """Scrapes the top 5 (title, link) headlines from a single Agrowon category page."""
+    logger.info(f"Scraping '{category}' from {url}")
+    try:
+        with metrics.UPSTREAM_SECONDS.labels("agrowon").time():
+            response = await client.get(url, timeout=NEWS_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to fetch URL {url}: {e!r}")
+        metrics.UPSTREAM_ERRORS.labels("agrowon").inc()
+        return []  # Return an empty list on network error
+
+    try:
+        # HTML parsing is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(parse_headlines, response.text, category)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while scraping {url}: {e}", exc_info=True)
+        metrics.UPSTREAM_ERRORS.labels("agrowon").inc()
+        return []
+
+
+async def scrape_all_news(client: httpx.AsyncClient, sources: dict[str, str]) -> dict[str, list[tuple[str, str]]]:
+    """Scrapes every category concurrently; returns {category: headlines} in the order of `sources`."""
+    results = await asyncio.gather(*(scrape_news_from_source(client, url, category) for category, url in sources.items()))
+    return dict(zip(sources, results))
+
+
+def render_news(scraped: dict[str, list[tuple[str, str]]]) -> Optional[tuple[str, str]]:
+    """Renders scraped headlines as (Telegram HTML, plain text), or None if nothing was scraped."""
+    html_parts = ["📰", "📰 **Latest Agricultural News**\n"]
+    text_parts = ["📰", "📰 **Latest Agricultural News**\n"]
+    for category, headlines in scraped.items():
+        if not headlines:
+            continue
+        # Add a bold category header
+        html_parts.append(f"\n<b>{html.escape(category)}</b>")
+        text_parts.append(f"\n{category}")
+        for title, link in headlines:
+            html_parts.append(f'• <a href="{html.escape(link)}">{html.escape(title)}</a>')
+            text_parts.append(f"• {title}")
+    if len(html_parts) == 2:
+        return None
+    html_parts.append("📰")
+    text_parts.append("📰")
+    return "\n".join(html_parts), "\n".join(text_parts)
+
+
+class NewsCache:
+    """
+    Latest Agrowon headlines, pre-rendered as HTML and plain text. A background
+    task refreshes it every `interval` seconds, so requests only read the cache;
+    a request waits for a scrape only before the first one has completed.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, sources: dict[str, str], interval: float):
+        self.client = client
+        self.sources = sources
+        self.interval = interval
+        self.html = None
+        self.text = None
+        self.timestamp = None  # time.time() of the last successful scrape
+        self._inflight = None
+
+    async def get(self, plain_text: bool = False) -> str:
+        if self.timestamp is None:
+            metrics.CACHE_REQUESTS.labels("news", "miss").inc()
+            await asyncio.shield(self.refresh())
+        else:
+            metrics.CACHE_REQUESTS.labels("news", "hit").inc()
+        if self.timestamp is None:
+            return NO_NEWS_MESSAGE
+        return self.text if plain_text else self.html
+
+    def refresh(self) -> asyncio.Task:
+        """Returns the in-flight scrape, starting one if none is running."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._scrape())
+        return self._inflight
+
+    async def _scrape(self):
+        rendered = render_news(await scrape_all_news(self.client, self.sources))
+        if rendered is None:
+            # Keep serving the previous headlines rather than an error
+            logger.warning("News scrape returned no headlines; keeping the cached news.")
+            return
+        self.html, self.text = rendered
+        self.timestamp = time.time()
+        logger.info("News cache refreshed.")
+
+    async def run_forever(self):
+        """Refresh loop meant to run as a background task for the lifetime of the bot."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing news: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
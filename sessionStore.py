@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class UserSession:
+    """Per-user state: recent messages and the token bucket of the rate limiter."""
+    __slots__ = ("history", "tokens", "refilled_at", "last_seen", "throttled", "dirty")
+
+    def __init__(self, history_size, burst, history=()):
+        self.history = deque(history, maxlen=history_size)
+        self.tokens = float(burst)
+        self.refilled_at = self.last_seen = time.monotonic()
+        self.throttled = False  # already told the user to slow down
+        self.dirty = False  # history changed since it was last persisted
+
+
+class SessionStore:
+    """
+    Bounded map of user_id -> UserSession. Least recently seen users are evicted
+    once `max_users` is reached, and users idle for `idle_ttl` seconds are swept
+    by evict_idle(). With `db_path`, histories are kept in SQLite write-behind:
+    evicted and changed sessions are queued and written in one transaction by
+    persist(), in a worker thread, and a returning user's history is read back
+    in a worker thread by get().
+    """
+
+    def __init__(self, max_users, idle_ttl, history_size=5, rate=10 / 60, burst=5, db_path=None):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.history_size = history_size
+        self.rate = rate  # tokens added per second
+        self.burst = burst  # bucket capacity
+        self._sessions = OrderedDict()  # ordered by last access, oldest first
+        self._pending = {}  # user_id -> history of an evicted session that is not written yet
+        self._in_flight = {}  # user_id -> history in the batch persist() is writing right now
+        self._db = None
+        self._db_lock = threading.Lock()  # the connection is shared by worker threads
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, history TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            history = self._pending.pop(user_id, None)
+            dirty = history is not None  # still has to be written
+            if history is None:
+                # Being written: SQLite may still hold an older copy until the batch commits
+                history = self._in_flight.get(user_id)
+            if history is None and self._db is not None:
+                history = await asyncio.to_thread(self._load, user_id)
+                # Another message from this user may have created the session meanwhile
+                session = self._sessions.get(user_id)
+            if session is None:
+                session = UserSession(self.history_size, self.burst, history or ())
+                session.dirty = dirty
+                self._sessions[user_id] = session
+                while len(self._sessions) > self.max_users:
+                    self._evict(*self._sessions.popitem(last=False))
+                return session
+        self._sessions.move_to_end(user_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def record(self, session, message):
+        """Appends a message to the user's history."""
+        session.history.append(message)
+        session.dirty = True
+
+    def allow(self, session):
+        """Token bucket: True if the user may send another request now."""
+        now = time.monotonic()
+        session.tokens = min(self.burst, session.tokens + (now - session.refilled_at) * self.rate)
+        session.refilled_at = now
+        if session.tokens < 1:
+            return False
+        session.tokens -= 1
+        session.throttled = False
+        return True
+
+    def evict_idle(self):
+        """Drops sessions idle for longer than idle_ttl; returns how many were evicted."""
+        cutoff = time.monotonic() - self.idle_ttl
+        evicted = 0
+        # The dict is ordered by last access, so idle sessions are all at the front
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > cutoff:
+                break
+            del self._sessions[user_id]
+            self._evict(user_id, session)
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} idle sessions; {len(self._sessions)} active.")
+        return evicted
+
+    async def persist(self):
+        """
+        Writes every evicted or changed history since the last call in one transaction,
+        in a worker thread. A batch that fails is kept and retried by the next call.
+        """
+        batch = self._take_pending()
+        if not batch:
+            return
+        try:
+            written = await asyncio.to_thread(self._write, batch)
+        finally:
+            self._in_flight = {}
+        if not written:
+            for user_id, history in batch.items():
+                session = self._sessions.get(user_id)
+                if session is not None:
+                    session.dirty = True
+                else:
+                    self._pending.setdefault(user_id, history)
+
+    def flush(self):
+        """Blocking persist(), for shutdown (no-op without a database)."""
+        self._write(self._take_pending())
+        self._in_flight = {}
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def _evict(self, user_id, session):
+        if self._db is not None and session.dirty:
+            self._pending[user_id] = list(session.history)
+
+    def _take_pending(self):
+        """{user_id: history} of every evicted or changed session, marked as written; kept visible to get() as in flight."""
+        if self._db is None:
+            return {}
+        batch, self._pending = self._pending, {}
+        for user_id, session in self._sessions.items():
+            if session.dirty:
+                batch[user_id] = list(session.history)
+                session.dirty = False
+        self._in_flight = batch
+        return batch
+
+    def _write(self, batch):
+        """Saves a _take_pending() batch in one transaction; returns False if it failed. Blocking."""
+        if not batch:
+            return True
+        now = time.time()
+        rows = [(user_id, json.dumps(history, ensure_ascii=False), now) for user_id, history in batch.items()]
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO sessions (user_id, history, updated_at) VALUES (?, ?, ?)", rows
+                    )
+                return True
+            except sqlite3.Error as e:
+                logger.error(f"Could not persist {len(rows)} sessions: {e}")
+                return False
+
+    def _load(self, user_id):
+        with self._db_lock:
+            if self._db is None:
+                return ()
+            try:
+                row = self._db.execute("SELECT history FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Could not load session {user_id}: {e}")
+                return ()
+        return json.loads(row[0]) if row else ()
@@ -1,32 +1,59 @@
 import asyncio
-import pandas as pd
 import os
-import re
-from datetime import datetime, date, timedelta
+import sys
+import time
+from datetime import date, timedelta
 from telegram import Update # Changed from telegram.ext import Updater
-from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
-# import asyncio # Can be removed if not used for other async tasks
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
 import logging
-from collections import defaultdict, deque
-from sentence_transformers import SentenceTransformer, util
-import torch
-import requests
-from bs4 import BeautifulSoup
+import multiprocessing
+from collections import OrderedDict
 
-import config, mapping
-
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-user_History = defaultdict(lambda: deque(maxlen=5))
+import config, mapping, metrics, queryRouter, services
+from itemResolver import ItemResolver, EMBEDDING_CACHE_FILE
+from priceStore import PriceStore, SNAPSHOT_DIR_NAME
+from queryRouter import QueryRouter
+from sessionStore import SessionStore
 
 # --- Cache Configuration ---
-# This dictionary will hold the scraped news and the time of the scrape.
-NEWS_CACHE = {
-    "data": None,
-    "timestamp": None
-}
-# We'll refresh the news if the cached data is older than 1 hour.
+# News is re-scraped in the background every CACHE_DURATION.
 CACHE_DURATION = timedelta(hours=1)
+# Weather readings are reused for WEATHER_CACHE_TTL seconds, then served stale
+# for up to WEATHER_MAX_STALE more seconds while a background refresh runs.
+WEATHER_CACHE_TTL = 10 * 60
+WEATHER_MAX_STALE = 60 * 60
+# Rendered get_rate answers kept for the most requested items
+RATE_CACHE_SIZE = 256
+# --- Deployment Configuration ---
+BOT_MODE = "polling"  # "polling" or "webhook"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "agribot"
+WEBHOOK_URL = None  # Public HTTPS URL Telegram should POST updates to, e.g. "https://example.com/agribot"
+WEBHOOK_SECRET = None  # Checked against the X-Telegram-Bot-Api-Secret-Token header
+CONCURRENT_UPDATES = 64  # Updates handled at once; one user's messages still run in order
+WORKER_PROCESSES = 0  # > 0 shards users across this many worker processes, each with its own AgriBot
+TELEGRAM_API_BASE_URL = None  # Override to use a local Bot API server, e.g. fakeServers.FakeTelegram
+
+# --- Session Configuration ---
+SESSION_MAX_USERS = 10000  # Users kept in memory; the least recently seen are evicted first
+SESSION_IDLE_TTL = 24 * 60 * 60  # Seconds of inactivity before a user's session is dropped
+SESSION_SWEEP_INTERVAL = 5 * 60
+SESSION_DB = None  # e.g. "sessions.sqlite3" to keep message history across evictions and restarts
+# Per-user token bucket: RATE_LIMIT_BURST messages at once, refilled at RATE_LIMIT_PER_MINUTE
+RATE_LIMIT_PER_MINUTE = 10
+RATE_LIMIT_BURST = 5
+
+# --- Monitoring Configuration ---
+METRICS_HOST = "127.0.0.1"  # Prometheus endpoint, local only
+METRICS_PORT = 9108  # None disables it; sharded workers listen on METRICS_PORT + 1 + worker index
+ADMIN_USER_IDS = set()  # Telegram user ids allowed to use /stats
+# Order of the stages in /stats; handle_message times "total", the rest are parts of it
+STATS_STAGES = ("total", "parse", "resolve_phrase", "resolve", "format", "weather", "news", "typing", "send")
+
+# Window (days) used by history questions that don't name a date range
+HISTORY_DEFAULT_DAYS = {queryRouter.TREND: 30, queryRouter.AVERAGE: 7, queryRouter.MINMAX: 30, queryRouter.CHANGE: 7}
+HISTORY_MAX_BUCKETS = 8  # rows in the trend breakdown
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -46,6 +73,8 @@ except Exception as e:
 
 CITY = ["Pune,IN","Solapur,IN","Nagpur,IN","Mumbai,IN","Nashik,IN"]
 DATA_DIR = "priceData"  # Directory containing your Excel files
+REPLY_DELAY = 0  # Optional extra pause (seconds) before each reply; 0 replies as soon as the answer is ready
+DATA_REFRESH_INTERVAL = 60  # Seconds between checks of DATA_DIR for new or modified workbooks
 ITEM_MAPPING_CONFIG = mapping.ITEM_MAPPING_CONFIG
 
 # --- Logging Setup ---
@@ -55,276 +84,649 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _mid(summary):
+    """Average modal price of a RangeSummary: mean of its average min and max rates."""
+    return (summary.avg_min + summary.avg_max) / 2
+
+def format_change(current, previous):
+    if previous is None or current is None:
+        return "n/a (not enough data)"
+    before, after = _mid(previous), _mid(current)
+    if before != before or after != after or before == 0:
+        return "n/a (not enough data)"
+    pct = (after - before) / before * 100
+    arrow = "📈" if pct > 0 else "📉" if pct < 0 else "➖"
+    return f"{arrow} {pct:+.1f}% ({format_rate(before)} → {format_rate(after)})"
+
+def _days_before(day, days):
+    """`day` minus `days` days, clamped to date.min so very long ranges can't overflow."""
+    return day - timedelta(days=min(days, (day - date.min).days))
+
+def format_rate(value):
+    """Formats a parsed rate back into the 'Rs. 6000/-' style used by the APMC sheets."""
+    if value != value:  # NaN: no trade recorded for the day
+        return "-"
+    # Averages are rounded to whole rupees like the source rates
+    return f"Rs. {value:.0f}/-"
+
+class LRUCache:
+    """Small bounded LRU with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
 class AgriBot:
     def __init__(self, data_dir=DATA_DIR, item_mapping=ITEM_MAPPING_CONFIG):
         self.data = {}
         self.data_dir = data_dir
         self.item_mapping = item_mapping
+        self.store = PriceStore(data_dir)
+        self.http = services.create_http_client()
+        self.weather = services.WeatherCache(self.http, config.OPENWTHR_API_KEY, WEATHER_CACHE_TTL, WEATHER_MAX_STALE)
+        self.news = services.NewsCache(self.http, mapping.NEWS_SOURCES, CACHE_DURATION.total_seconds())
+        # Precomputed embeddings live next to the price snapshots; only read when exact and fuzzy lookups miss
+        self.resolver = ItemResolver(item_mapping, embedding_cache=os.path.join(data_dir, SNAPSHOT_DIR_NAME, EMBEDDING_CACHE_FILE))
+        self.router = QueryRouter(CITY)
+        self.semantic_lookup = True  # switched off if sentence-transformers is unavailable
+        # Keyed by (item, until, series version): a reload rebuilds the series with a new version,
+        # so answers for changed items stop matching while unchanged items stay cached.
+        self.rate_cache = LRUCache(RATE_CACHE_SIZE)
         self.load_data()
 
     def load_data(self):
-        """Loads and consolidates data, storing multiple entries per item."""
+        """Loads the full price history of every item into the columnar price store."""
         logger.info(f"Loading data from directory: {self.data_dir}")
-        if not os.path.isdir(self.data_dir):
-            logger.error(f"Data directory '{self.data_dir}' not found. Please create it and add your Excel files.")
-            return
-
-        for filename in os.listdir(self.data_dir): # Read from the specified data_dir
-            # Check if the file starts with the expected prefix and is an Excel file
-            if filename.startswith("Pune_Market_Rates_") and filename.endswith(".xlsx"):
-                filepath = os.path.join(self.data_dir, filename)
-                try:
-                    df = pd.read_excel(filepath)
-                    required_columns = {"Date", "Market", "शेतिमाल", "किमान", "कमाल","परिमाण"}
-                    if not required_columns.issubset(df.columns):
-                        logger.warning(f"Skipping {filepath}: Incomplete data format. Missing columns: {required_columns - set(df.columns)}")
-                        continue
-                    for _, row in df.iterrows():
-                        date_str = row["Date"]
-                        try:
-                            data_date = datetime.strptime(str(date_str), "%d-%m-%Y").date()
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Skipping row in {filepath}: Invalid date '{date_str}'. Error: {e}")
-                            continue
-
-                        item = row["शेतिमाल"]
-                        if item and pd.notna(item):
-                            if item not in self.data:
-                                self.data[item] = []
-                            self.data[item].append({
-                                "date": data_date,
-                                "min_rate": row["किमान"],
-                                "max_rate": row["कमाल"],
-                                "market": row["Market"],
-                                "quantity": row["परिमाण"]
-                            })
-                        else:
-                            logger.warning(f"Skipping row in {filepath}: Empty item name.")
-                except Exception as e:
-                    logger.error(f"Error reading {filepath}: {e}")
-
-        for item, entries in self.data.items():
-            entries.sort(key=lambda x: x["date"], reverse=True)
-            self.data[item] = entries[:5]
+        with metrics.DATA_LOAD_SECONDS.labels("load").time():
+            self.data = self.store.load()
+            self.resolver.update_items(self.data)
+            self.router.update_items(self.resolver.spellings())
+        metrics.DATA_ITEMS.set(len(self.data))
+        metrics.DATA_VERSION.set(self.store.version)
 
         if not self.data:
             logger.warning("No valid data loaded. Check your Excel files in the '%s' directory.", self.data_dir)
         else:
             logger.info(f"Loaded data for {len(self.data)} items.")
 
-    def _scrape_news_from_source(self,url: str, category: str) -> list[str]:
+    async def aclose(self):
+        """Closes the pooled HTTP client."""
+        await self.http.aclose()
+
+    def refresh_data(self):
+        """
+        Merges new or modified workbooks from data_dir into the price store.
+        Blocking; the watcher runs it in a worker thread. Returns True if anything changed.
+        """
+        start = time.perf_counter()
+        if not self.store.refresh():
+            return False
+        self.data = self.store.series
+        self.resolver.update_items(self.data)
+        self.router.update_items(self.resolver.spellings())
+        # Only reloads that changed something are recorded; unchanged scans would swamp the histogram
+        metrics.DATA_LOAD_SECONDS.labels("reload").observe(time.perf_counter() - start)
+        metrics.DATA_ITEMS.set(len(self.data))
+        metrics.DATA_VERSION.set(self.store.version)
+        logger.info(f"Price data reloaded: {len(self.data)} items (version {self.store.version}).")
+        return True
+
+    async def get_latest_agrowon_news(self, plain_text=False):
         """
-        Scrapes the top 5 headlines from a single Agrowon category page.
-        This is a private helper function.
+        Returns the latest Agrowon news from the background-refreshed cache,
+        as Telegram HTML or as plain text.
         """
-        logging.info(f"Scraping '{category}' from {url}")
-        headlines = []
+        with metrics.stage("news"):
+            return await self.news.get(plain_text)
+
+    def resolve_item(self, item):
+        """Item name in the price data for what the user typed (exact or fuzzy match), or None."""
+        return self.resolver.resolve(item)
+
+    async def resolve_item_semantic(self, item):
+        """Embedding-based fallback for resolve_item; loads the model on first use, off the event loop."""
+        if not self.semantic_lookup:
+            return None
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            # The class name 'headline-m_headline__...' is dynamic.
-            # We use a "contains" selector `[class*='...']` to make it more stable.
-            headline_tags = soup.select("h6[class*='headline-m_headline__']")
-
-            if not headline_tags:
-                logging.warning(f"No headline tags found for '{category}'. The website selector might be outdated.")
-                return []
-
-            for h6 in headline_tags[:5]:  # Limit to the top 5 headlines
-                # The link is in the parent 'a' tag of the 'h6'
-                link_tag = h6.find_parent('a')
-                if link_tag and link_tag.get('href'):
-                    title = h6.get_text(strip=True)
-                    link = link_tag['href']
-
-                    # Links on the site are relative (e.g., /weather-news/...). We must make them absolute.
-                    if not link.startswith('http'):
-                        base_url = "https://agrowon.esakal.com"
-                        link = f"{base_url}{link}"
-
-                    # Format for Telegram HTML links
-                    headlines.append(f'• <a href="{link}">{title}</a>')
-
-            return headlines
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Failed to fetch URL {url}: {e}")
-            return []  # Return an empty list on network error
+            return await asyncio.to_thread(self.resolver.resolve_semantic, item)
+        except ImportError:
+            logger.warning("sentence-transformers is not installed; semantic item lookup disabled.")
+            self.semantic_lookup = False
+            return None
         except Exception as e:
-            logging.error(f"An unexpected error occurred while scraping {url}: {e}", exc_info=True)
-            return []
+            logger.error(f"Semantic item lookup failed for '{item}': {e}", exc_info=True)
+            return None
 
-    def get_latest_agrowon_news(self):
+    def get_rate(self, item, until=None):
+        """Retrieves rates for an item, returning the last 5 entries (up to `until` if given)."""
+        with metrics.stage("resolve"):
+            item_marathi = self.resolve_item(item) or item
+
+        series = self.data.get(item_marathi)
+        if series is None:
+            return f"Could not find any rate information for {item_marathi}. Are you sure it's a common crop? What else can I look up?"
+
+        key = (item_marathi, until, series.version)
+        response = self.rate_cache.get(key)
+        if response is None:
+            with metrics.stage("format"):
+                response = self._render_rate(item_marathi, series.latest(5, until=until))
+            self.rate_cache.put(key, response)
+        return response
+
+    def get_price_history(self, item, stat, date_range=None, until=None):
         """
-        Fetches the latest news from Agrowon, using a 1-hour cache.
-        This is the main function your bot should call.
+        Answers trend / average / min-max / week-over-week questions for one item.
+        Every figure comes from ItemSeries.summarize, so no raw rows are scanned.
         """
-        # 1. Check if we have valid, non-expired data in the cache
-        if NEWS_CACHE["data"] and NEWS_CACHE["timestamp"]:
-            if datetime.now() - NEWS_CACHE["timestamp"] < CACHE_DURATION:
-                logging.info("Returning fresh news from cache.")
-                return NEWS_CACHE["data"]
-
-        # 2. If cache is empty or expired, perform a fresh scrape
-        logging.info("Cache is stale or empty. Performing a fresh scrape.")
-
-        all_news_parts = ["📰 **Latest Agricultural News**\n"]
-        has_news = False
-
-        for category, url in mapping.NEWS_SOURCES.items():
-            scraped_headlines = self._scrape_news_from_source(url, category)
-            if scraped_headlines:
-                has_news = True
-                # Add a bold category header
-                all_news_parts.append(f"\n<b>{category}</b>")
-                all_news_parts.extend(scraped_headlines)
-
-        if not has_news:
-            return "Sorry, I couldn't retrieve any news at the moment. Please try again later."
-
-        final_response = "\n".join(all_news_parts)
-
-        # 3. Update the cache with the newly scraped data and the current time
-        NEWS_CACHE["data"] = final_response
-        NEWS_CACHE["timestamp"] = datetime.now()
-
-        return "📰\n"+final_response+"\n📰"
-
-    def get_rate(self, item):
-        """Retrieves rates for an item, returning the last 5 entries."""
-        standardized_item = item.lower()
-        item_marathi = self.item_mapping.get(standardized_item, item)
-
-        if item_marathi in self.data:
-            entries = self.data[item_marathi]
-            if entries:
-                # Determine the market from the most recent entry for display
-                market = entries[0]['market'] if entries else "N/A"
-
-                response_parts = [f"📊 Recent rates for {item_marathi}: \nMarket: 📍{market}📍\n"]
-                # Using a simple pre-formatted text for table-like appearance
-                # Telegram's Markdown for tables can be tricky and might require escaping
-                header = f"{'Date 📅':<10} | {'Min 📉':<8} | {'Max 📈':<8}"
-                response_parts.append(header)
-                response_parts.append("-" * (len(header) + 2)) # Separator line
-                quantity=""
-                for entry in entries:
-                    date_str = entry['date'].strftime('%d %b')
-                    # Ensure rates are strings for consistent formatting
-                    min_rate_str = str(entry['min_rate'])
-                    max_rate_str = str(entry['max_rate'])
-                    quantity = str(entry['quantity'])
-                    row_str = f"{date_str:<10} | {min_rate_str:<8} | {max_rate_str:<8}"
-                    response_parts.append(row_str)
-                response_parts.append("-" * (len(header) + 2))
-                if quantity == "शेकडा":
-                    response_parts.append("❗️Rates of 100 Piece❗")
-                else:
-                    response_parts.append(f"️❗️Rates of 100 Kg❗")
-                response_parts.append("\n🌾Anything else I can assist with?🌾\n💬")
-                return "\n".join(response_parts)
-            else:
-                return f"No rate information found for {item_marathi}. Perhaps it's not traded recently? Anything else?"
-        else:
+        with metrics.stage("resolve"):
+            item_marathi = self.resolve_item(item) or item
+        series = self.data.get(item_marathi)
+        if series is None:
             return f"Could not find any rate information for {item_marathi}. Are you sure it's a common crop? What else can I look up?"
 
-    def get_weather(self):
+        if date_range:
+            start, end = date_range
+        else:
+            # Without an explicit range, look back from the requested day or the newest data
+            end = min(until, series.last_date) if until else series.last_date
+            start = _days_before(end, HISTORY_DEFAULT_DAYS[stat] - 1)
+
+        key = (item_marathi, stat, start, end, series.version)
+        response = self.rate_cache.get(key)
+        if response is None:
+            with metrics.stage("format"):
+                response = self._render_history(series, stat, start, end)
+            self.rate_cache.put(key, response)
+        return response
+
+    def _render_history(self, series, stat, start, end):
+        item_marathi = series.item
+        period = f"{start.strftime('%d %b %Y')} – {end.strftime('%d %b %Y')}"
+        summary = series.summarize(start, end)
+        if summary is None:
+            latest = series.last_date.strftime('%d %b %Y')
+            return f"No rates recorded for {item_marathi} between {period}. The latest data is from {latest}."
+
+        days = (end - start).days + 1
+        previous = None
+        if start > date.min:
+            previous = series.summarize(_days_before(start, days), start - timedelta(days=1))
+        unit = "100 Piece" if series.quantity[-1] == "शेकडा" else "100 Kg"
+        parts = []
+        if stat == queryRouter.AVERAGE:
+            parts.append(f"📊 Average rates for {item_marathi} ({period}):")
+            parts.append(f"Min 📉: {format_rate(summary.avg_min)}\nMax 📈: {format_rate(summary.avg_max)}")
+            parts.append(f"Based on {max(summary.traded_min, summary.traded_max)} trading days.")
+        elif stat == queryRouter.MINMAX:
+            parts.append(f"📊 Price range for {item_marathi} ({period}):")
+            parts.append(f"Lowest 📉: {format_rate(summary.low)}\nHighest 📈: {format_rate(summary.high)}")
+            parts.append(f"Based on {max(summary.traded_min, summary.traded_max)} trading days.")
+        elif stat == queryRouter.CHANGE:
+            parts.append(f"📊 Change for {item_marathi}, last {days} days vs the {days} days before ({period}):")
+            parts.append(format_change(summary, previous))
+        else:
+            parts.append(f"📈 Trend for {item_marathi} ({period}):")
+            header = f"{'From 📅':<10} | {'Avg Min':<10} | {'Avg Max':<10}"
+            parts.append(header)
+            parts.append("-" * (len(header) + 2))
+            bucket = max(7, -(-days // HISTORY_MAX_BUCKETS))
+            bucket_start = start
+            while True:
+                bucket_end = bucket_start + timedelta(days=min(bucket - 1, (end - bucket_start).days))
+                window = series.summarize(bucket_start, bucket_end)
+                if window:
+                    parts.append(f"{bucket_start.strftime('%d %b'):<10} | {format_rate(window.avg_min):<10} | {format_rate(window.avg_max):<10}")
+                if bucket_end >= end:  # stepping past `end` could overflow at date.max
+                    break
+                bucket_start = bucket_end + timedelta(days=1)
+            parts.append("-" * (len(header) + 2))
+            parts.append(f"Lowest: {format_rate(summary.low)}  Highest: {format_rate(summary.high)}")
+            parts.append(f"vs previous {days} days: {format_change(summary, previous)}")
+        parts.append(f"❗️Rates of {unit}❗")
+        parts.append("\n🌾Anything else I can assist with?🌾\n💬")
+        return "\n".join(parts)
+
+    def _render_rate(self, item_marathi, entries):
+        if not entries:
+            return f"No rate information found for {item_marathi}. Perhaps it's not traded recently? Anything else?"
+        # Determine the market from the most recent entry for display
+        market = entries[0][3]
+
+        response_parts = [f"📊 Recent rates for {item_marathi}: \nMarket: 📍{market}📍\n"]
+        # Using a simple pre-formatted text for table-like appearance
+        # Telegram's Markdown for tables can be tricky and might require escaping
+        header = f"{'Date 📅':<10} | {'Min 📉':<8} | {'Max 📈':<8}"
+        response_parts.append(header)
+        response_parts.append("-" * (len(header) + 2)) # Separator line
+        quantity=""
+        for entry_date, min_rate, max_rate, _, quantity in entries:
+            date_str = entry_date.strftime('%d %b')
+            row_str = f"{date_str:<10} | {format_rate(min_rate):<8} | {format_rate(max_rate):<8}"
+            response_parts.append(row_str)
+        response_parts.append("-" * (len(header) + 2))
+        if quantity == "शेकडा":
+            response_parts.append("❗️Rates of 100 Piece❗")
+        else:
+            response_parts.append(f"️❗️Rates of 100 Kg❗")
+        response_parts.append("\n🌾Anything else I can assist with?🌾\n💬")
+        return "\n".join(response_parts)
+
+    async def get_weather(self, cities=None):
+        """Current weather for `cities` (default: every entry in CITY), served from the per-city cache."""
+        cities = cities or CITY
         result = ""
-        for ct in CITY:
-            URL = f"https://api.openweathermap.org/data/2.5/weather?q={ct}&appid={config.OPENWTHR_API_KEY}&units=metric"
-            response = requests.get(URL)
-            data = response.json()
-            if response.status_code == 200:
-                weather = data['weather'][0]['main']  # e.g., Rain, Clear, Clouds
-                temp = data['main']['temp']  # current temp
-                feels_like = data['main']['feels_like']
-                humidity = data['main']['humidity']
-                # Simplified interpretation
-                status = {
-                    "Rain": "🌧Rain expected⛈",
-                    "Clear": "☀️Sunny☀️",
-                    "Clouds": "⛅️Cloudy🌤"
-                }.get(weather, weather)
-                result = result + f"☀️Weather in {ct}📍:\nTemperature: {temp}°C🌡 (Feels like {feels_like}°C🌡)\nWeather: {status} \tHumidity: {humidity}%\n\n"
-            else:
-                print("Could not fetch weather info.")
-        return result
-
-    def respond_to_query(self, query: str) -> str:
+        with metrics.stage("weather"):
+            readings = await self.weather.get_many(cities)
+        for ct, data in zip(cities, readings):
+            if data is None:
+                continue
+            weather = data['weather'][0]['main']  # e.g., Rain, Clear, Clouds
+            temp = data['main']['temp']  # current temp
+            feels_like = data['main']['feels_like']
+            humidity = data['main']['humidity']
+            # Simplified interpretation
+            status = {
+                "Rain": "🌧Rain expected⛈",
+                "Clear": "☀️Sunny☀️",
+                "Clouds": "⛅️Cloudy🌤"
+            }.get(weather, weather)
+            result = result + f"☀️Weather in {ct}📍:\nTemperature: {temp}°C🌡 (Feels like {feels_like}°C🌡)\nWeather: {status} \tHumidity: {humidity}%\n\n"
+        return result or "Sorry, I couldn't fetch the weather right now. Please try again later."
+
+    async def respond_to_query(self, query: str) -> str:
         """Analyzes the user's query and calls the appropriate function."""
-        query_lower = str(query).lower()
-        #item_match = re.search(r"(?:rate|price)\s+(?:of)?\s*(.+)", query_lower)
-        # Match: "rate of xyz", "price xyz", "xyz rate", or just "xyz"
-        item_match = re.search(r"(?:rate|price)\s+(?:of\s+)?(.+)|(.+)\s*(?:rate|price)?$",query_lower)
-        if "weather" in query_lower:
-            return self.get_weather()
-            #return ("I currently don't support weather 🌤 but I can help with crop🌾 rates.")
-        elif "news" in query_lower:
-            news_html = self.get_latest_agrowon_news()
-            # This part simulates how the bot would see the text, without the HTML tags
-            if '<a href=' in news_html:
-                return (BeautifulSoup(news_html, "html.parser").get_text())
-            else:
-                return (news_html)
-        elif item_match:
-            item = item_match.group(1) if item_match.group(1) else item_match.group(2)
-            # Clean up date/time text like "on date", "for date", "today", etc.
-            item = re.sub(r'\s+(on|for)\s+(date\s*)?.*$', '', item, flags=re.IGNORECASE).strip()
-            item = re.sub(r'\s+today$', '', item, flags=re.IGNORECASE).strip()
-        # if item_match:
-        #     item = item_match.group(1).strip()
-        #     item = re.sub(r'\s+(on|for)\s+date.*$', '', item, flags=re.IGNORECASE).strip()
-        #     item = re.sub(r'\s+today$', '', item, flags=re.IGNORECASE).strip()
-            if not item:
-                 return ("It seems you asked for a rate, but I couldn't identify the item. "
+        with metrics.stage("parse"):
+            parsed = self.router.parse(query)
+        metrics.MESSAGES.labels(parsed.intent or "unknown").inc()
+        if parsed.intent == queryRouter.WEATHER:
+            return await self.get_weather(parsed.cities)
+        elif parsed.intent == queryRouter.NEWS:
+            # Replies are sent without parse_mode, so use the pre-rendered plain-text variant
+            return await self.get_latest_agrowon_news(plain_text=True)
+        elif parsed.intent == queryRouter.RATE or parsed.unresolved:
+            items = list(parsed.items)
+            unknown = []
+            # Embeddings are slow and match almost anything, so they only run for rate questions
+            # (a rate keyword, stat or known item); other leftover text must hit the exact or n-gram stage
+            semantic = parsed.intent == queryRouter.RATE
+            for phrase in parsed.unresolved:
+                # Own label: get_rate/get_price_history time the per-item "resolve" stage
+                with metrics.stage("resolve_phrase"):
+                    item = await self._resolve_phrase(phrase, semantic)
+                if item:
+                    if item not in items:
+                        items.append(item)
+                else:
+                    unknown.append(phrase)
+            if items:
+                if parsed.stat:
+                    return "\n\n".join(
+                        self.get_price_history(item, parsed.stat, parsed.date_range, until=parsed.on_date) for item in items
+                    )
+                until = parsed.date_range[1] if parsed.date_range else parsed.on_date
+                return "\n\n".join(self.get_rate(item, until=until) for item in items)
+            if unknown and queryRouter.RATE in parsed.keywords:
+                # Explicit "rate of xyz": say we don't know xyz, as before
+                return self.get_rate(unknown[0])
+            if parsed.intent == queryRouter.RATE and not unknown:
+                return ("It seems you asked for a rate, but I couldn't identify the item. "
                         "Could you please specify it? For example: 'Rate of Kanda'")
-            return self.get_rate(item)
-        else:
-            return ("I understand you're asking about prices, but could you please specify the item? "
-                    "For example, you could ask 'What is the rate of tomato?'")
+        return ("I understand you're asking about prices, but could you please specify the item? "
+                "For example, you could ask 'What is the rate of tomato?'")
+
+    async def _resolve_phrase(self, phrase, semantic=True):
+        """Resolves a leftover phrase, word by word if needed, falling back to embeddings if `semantic`."""
+        item = self.resolve_item(phrase)
+        if item is None and " " in phrase:
+            for word in phrase.split():
+                item = self.resolve_item(word)
+                if item:
+                    return item
+        if item or not semantic:
+            return item
+        return await self.resolve_item_semantic(phrase)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE): # Changed type hint to Update
     user_message = update.message.text
     user_id = update.effective_user.id
-    user_History[user_id].append(user_message)
+    sessions = context.bot_data.get('sessions')
+    if sessions is not None:
+        session = await sessions.get(user_id)
+        if not sessions.allow(session):
+            # Tell the user once, then drop further messages until the bucket refills
+            metrics.THROTTLED.inc()
+            if not session.throttled:
+                session.throttled = True
+                await update.message.reply_text("⏳ You're sending messages too quickly. Please wait a moment and try again.")
+            return
+        sessions.record(session, user_message)
     bot_instance = context.bot_data.get('agri_bot')
     if not bot_instance:
         logger.error("AgriBot instance not found in bot_data.")
         await update.message.reply_text("🚧 Sorry, I'm having some technical difficulties. Please try again later.")
         return
 
+    typing = None
     try:
-        logger.info(f"Received message from {update.effective_user.username if update.effective_user else 'UnknownUser'}: {user_message}")
-        response = bot_instance.respond_to_query(user_message)
-        # For pre-formatted text, usually no specific parse_mode is needed,
-        # but if you use Markdown characters, you'd set parse_mode=ParseMode.MARKDOWN_V2
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
-        await asyncio.sleep(1.5)
-        await update.message.reply_text(response)
+        with metrics.stage("total"):
+            logger.info(f"Received message from {update.effective_user.username if update.effective_user else 'UnknownUser'}: {user_message}")
+            # The typing indicator goes out while the answer is prepared instead of delaying it
+            typing = asyncio.create_task(_send_typing(context.bot, update.effective_chat.id))
+            response = await bot_instance.respond_to_query(user_message)
+            # For pre-formatted text, usually no specific parse_mode is needed,
+            # but if you use Markdown characters, you'd set parse_mode=ParseMode.MARKDOWN_V2
+            if REPLY_DELAY:
+                await asyncio.sleep(REPLY_DELAY)
+            with metrics.stage("send"):
+                await update.message.reply_text(response)
 
     except Exception as e:
         logger.error(f"Error handling message: {e}", exc_info=True)
+        metrics.HANDLER_ERRORS.inc()
         await update.message.reply_text("Oops! Something went wrong on my end. Please try again.")
+    finally:
+        if typing is not None:
+            await typing
+
+async def _send_typing(bot, chat_id):
+    """Sends the 'typing…' chat action; a failure is only logged since the reply matters more."""
+    try:
+        with metrics.stage("typing"):
+            await bot.send_chat_action(chat_id=chat_id, action='typing')
+    except Exception as e:
+        logger.warning(f"Could not send typing action to {chat_id}: {e}")
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+def format_stats():
+    """Plain-text summary of this process's metrics for the /stats command."""
+    uptime = timedelta(seconds=int(time.time() - metrics.START_TIME.labels().get()))
+    lines = [f"📈 Bot statistics (pid {os.getpid()}, up {uptime})", "", "⏱ Stages, ms (count | p50 | p99 | avg):"]
+    stages = dict(metrics.STAGE_SECONDS.series())
+    for (stage,) in sorted(stages, key=lambda key: STATS_STAGES.index(key[0]) if key[0] in STATS_STAGES else len(STATS_STAGES)):
+        series = stages[(stage,)]
+        lines.append(f"{stage}: {series.count} | {_ms(series.quantile(0.5))} | {_ms(series.quantile(0.99))} | {_ms(series.mean())}")
+
+    lines.append("\n🌐 Upstream, ms (requests | p50 | p99 | errors):")
+    errors = {service: series.get() for (service,), series in metrics.UPSTREAM_ERRORS.series()}
+    for (service,), series in metrics.UPSTREAM_SECONDS.series():
+        lines.append(f"{service}: {series.count} | {_ms(series.quantile(0.5))} | {_ms(series.quantile(0.99))} | {errors.get(service, 0):.0f}")
+
+    lines.append("\n🗃 Caches:")
+    caches = {}
+    for (cache, result), series in metrics.CACHE_REQUESTS.series():
+        caches.setdefault(cache, {})[result] = series.get()
+    for cache, results in caches.items():
+        total = sum(results.values())
+        hit_rate = f"{results.get('hit', 0) / total:.0%} hits" if total else "unused"
+        lines.append(f"{cache}: {hit_rate} ({', '.join(f'{result} {count:.0f}' for result, count in results.items())})")
+
+    intents = ", ".join(f"{intent} {series.get():.0f}" for (intent,), series in metrics.MESSAGES.series()) or "none"
+    lines.append(f"\n💬 Messages: {intents}; throttled {metrics.THROTTLED.labels().get():.0f}, errors {metrics.HANDLER_ERRORS.labels().get():.0f}")
+    lines.append(f"👥 Sessions: {metrics.SESSIONS.labels().get():.0f}")
+    lines.append(f"🌾 Data: {metrics.DATA_ITEMS.labels().get():.0f} items, version {metrics.DATA_VERSION.labels().get():.0f}")
+    for (kind,), series in metrics.DATA_LOAD_SECONDS.series():
+        if not series.count:
+            continue  # first load still running
+        lines.append(f"{kind}: {series.count}x, avg {series.sum / series.count:.2f}s")
+    return "\n".join(lines)
+
+async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats for the users in ADMIN_USER_IDS; everyone else is ignored."""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_USER_IDS:
+        logger.warning(f"Ignoring /stats from non-admin user {user.id if user else 'unknown'}.")
+        return
+    await update.message.reply_text(format_stats())
+
+async def watch_price_data(bot_instance, interval=DATA_REFRESH_INTERVAL):
+    """Polls the data directory and hot-loads new market-rate workbooks off the event loop."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(bot_instance.refresh_data)
+        except Exception as e:
+            logger.error(f"Error refreshing price data: {e}", exc_info=True)
+
+async def sweep_sessions(sessions, interval=SESSION_SWEEP_INTERVAL):
+    """Drops idle sessions and persists changed histories (when SESSION_DB is set)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sessions.evict_idle()
+            # One transaction per sweep, off the event loop
+            await sessions.persist()
+        except Exception as e:
+            logger.error(f"Error sweeping sessions: {e}", exc_info=True)
+
+def create_session_store():
+    return SessionStore(
+        SESSION_MAX_USERS,
+        SESSION_IDLE_TTL,
+        rate=RATE_LIMIT_PER_MINUTE / 60,
+        burst=RATE_LIMIT_BURST,
+        db_path=SESSION_DB,
+    )
+
+async def start_background_tasks(app):
+    bot_instance = app.bot_data['agri_bot']
+    sessions = app.bot_data['sessions']
+    app.bot_data['background_tasks'] = [
+        asyncio.create_task(watch_price_data(bot_instance)),
+        asyncio.create_task(bot_instance.news.run_forever()),
+        asyncio.create_task(sweep_sessions(sessions)),
+    ]
+    # Values that already exist elsewhere are read when metrics are collected instead of being counted twice
+    metrics.SESSIONS.labels().set_function(lambda: len(sessions))
+    metrics.CACHE_REQUESTS.labels("rate", "hit").set_function(lambda: bot_instance.rate_cache.hits)
+    metrics.CACHE_REQUESTS.labels("rate", "miss").set_function(lambda: bot_instance.rate_cache.misses)
+    port = app.bot_data.get('metrics_port', METRICS_PORT)
+    if port is not None:
+        try:
+            app.bot_data['metrics_server'] = await metrics.start_metrics_server(METRICS_HOST, port)
+        except OSError as e:
+            logger.error(f"Could not start the metrics endpoint on {METRICS_HOST}:{port}: {e}")
+
+async def stop_background_tasks(app):
+    for task in app.bot_data.pop('background_tasks', []):
+        task.cancel()
+    server = app.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+    app.bot_data['sessions'].close()
+    await app.bot_data['agri_bot'].aclose()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at once, but the updates of any
+    one user run one after another, in the order they arrived.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        # BaseUpdateProcessor takes its semaphore before do_process_update, so an update queued
+        # behind its own user's lock would hold a slot and a flooding user could starve everyone
+        # else. Its semaphore is left effectively unlimited and the real limit is applied below,
+        # only once the user's turn has come.
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(sys.maxsize)
+        # Report the real limit through max_concurrent_updates (and Application.concurrent_updates)
+        self._max_concurrent_updates = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._running = 0
+        self._user_locks = {}  # user id -> [lock, updates holding or waiting on it]
+
+    @property
+    def current_concurrent_updates(self):
+        return self._running
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await self._run(coroutine)
+            return
+        entry = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def _application_builder():
+    builder = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN)
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    return builder
+
+def build_bot_application(bot_instance, with_updater=True):
+    """Application that answers messages with `bot_instance`; updates of different users run concurrently."""
+    builder = (
+        _application_builder()
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(start_background_tasks)
+        .post_shutdown(stop_background_tasks)
+    )
+    if not with_updater:
+        builder = builder.updater(None)
+    app = builder.build()
+    app.bot_data['agri_bot'] = bot_instance
+    app.bot_data['sessions'] = create_session_store()
+    app.add_handler(CommandHandler("stats", handle_stats))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return app
+
+def run_application(app):
+    """Runs `app` until interrupted, receiving updates by webhook or long polling (BOT_MODE)."""
+    if BOT_MODE == "webhook":
+        logger.info(f"Bot starting webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        logger.info("Bot starting to poll...")
+        app.run_polling()
+
+# --- Multi-process Mode ---
+# One ingress process receives updates and hands each to worker `user_id % WORKER_PROCESSES`,
+# so every user is always served by the same worker (keeping their messages in order)
+# while different users are spread across CPU cores.
+
+def _shard_of(update, shards):
+    user = update.effective_user
+    chat = update.effective_chat
+    key = user.id if user else chat.id if chat else 0
+    return key % shards
+
+def build_ingress_application(queues):
+    """Application that only forwards raw updates to the worker queues."""
+    async def forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        queues[_shard_of(update, len(queues))].put(update.to_dict())
+
+    app = _application_builder().build()
+    app.add_handler(TypeHandler(Update, forward))
+    return app
+
+async def serve_worker(queue, metrics_port=None):
+    """Worker loop: feeds updates from the ingress queue into a local Application until it gets None."""
+    app = build_bot_application(AgriBot(), with_updater=False)
+    app.bot_data['metrics_port'] = metrics_port
+    await app.initialize()
+    # post_init/post_shutdown only run inside run_polling/run_webhook, so call them here
+    await start_background_tasks(app)
+    await app.start()
+    try:
+        while True:
+            data = await asyncio.to_thread(queue.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        await stop_background_tasks(app)
+        await app.shutdown()
+
+def run_worker(index, queue, api_base_url=None):
+    # Spawned workers re-import this module, so settings changed at runtime are passed in explicitly
+    global TELEGRAM_API_BASE_URL
+    TELEGRAM_API_BASE_URL = api_base_url
+    logger.info(f"Worker {index} starting (pid {os.getpid()}).")
+    try:
+        # Each worker has its own metrics, so each serves them on its own port
+        asyncio.run(serve_worker(queue, None if METRICS_PORT is None else METRICS_PORT + 1 + index))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(workers):
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [ctx.Process(target=run_worker, args=(i, q, TELEGRAM_API_BASE_URL), name=f"agribot-worker-{i}", daemon=True) for i, q in enumerate(queues)]
+    for process in processes:
+        process.start()
+    try:
+        run_application(build_ingress_application(queues))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=10)
 
 def main():
     if not TELEGRAM_BOT_TOKEN:
         # Logger already prints a critical message if token is None
         return
 
-    agri_bot_instance = AgriBot()
-
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-    app.bot_data['agri_bot'] = agri_bot_instance
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    if WORKER_PROCESSES > 0:
+        run_sharded(WORKER_PROCESSES)
+        return
 
-    logger.info("Bot starting to poll...")
-    app.run_polling()
+    run_application(build_bot_application(AgriBot()))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()